@@ -0,0 +1,65 @@
+"""Cold vs warm AWS client setup cost per request.
+
+Simulates what each /analyze request had to build before the pooled registry
+(DynamoDB resource + Table, S3 client) and compares it with the registry path.
+Only construction is measured (no network), so the TLS handshake saved by the
+keep-alive pool comes on top of the numbers printed here.
+
+    python bench/bench_aws_clients.py [iterations]
+"""
+
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+os.environ.setdefault("CLOTHES_TABLE_NAME", "Clothes-bench")
+os.environ.setdefault("WEARLOG_TABLE_NAME", "WearingLog-bench")
+
+import index  # noqa: E402
+
+
+def _simulated_request() -> None:
+    index._get_table()
+    index._get_wearlog_table()
+    index._get_aws_client("s3")
+
+
+def _run(n: int, *, cold: bool) -> list:
+    timings = []
+    for _ in range(n):
+        if cold:
+            index._reset_aws_clients()
+        start = time.perf_counter()
+        _simulated_request()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    # Prime botocore's on-disk model loader so "cold" means per-request rebuild,
+    # not first import.
+    index._warm_up()
+
+    cold = _run(n, cold=True)
+    index._warm_up()
+    warm = _run(n, cold=False)
+
+    for label, t in (("cold", cold), ("warm", warm)):
+        print(
+            f"{label}: avg {statistics.mean(t):.3f}ms  "
+            f"p50 {statistics.median(t):.3f}ms  max {max(t):.3f}ms"
+        )
+    print(f"saved per request: {statistics.mean(cold) - statistics.mean(warm):.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
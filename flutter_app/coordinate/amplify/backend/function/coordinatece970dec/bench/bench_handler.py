@@ -0,0 +1,517 @@
+"""End-to-end `handler` benchmark with local stand-ins (no AWS, no Gemini).
+
+- DynamoDB / S3: in-memory stand-ins registered in index's AWS client
+  registry. Items round-trip through boto3's type (de)serializer, so handlers
+  see Decimal and set values like they do in production. Query pages stop at
+  Limit only (no 1 MB boundary).
+- Gemini: a local HTTP stub of generateContent with a configurable delay and
+  an optional slow tail (a fraction of calls take `factor` times longer),
+  reached through GEMINI_API_BASE_URL.
+- Events: API Gateway proxy events built from src/event.json.
+
+Reports p50/p95/p99 latency and peak traced allocation per request for each
+route across closet sizes. Every /analyze request uses a distinct selfie, so
+the detection cache never hides the Gemini round trip.
+
+    python bench/bench_handler.py [--sizes 10,100,1000,10000] [--iterations 50] [--gemini-delay-ms 0] [--stream]
+        [--gemini-slow-ratio 0.05 --gemini-slow-factor 10] [--hedge]
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+_HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(_HERE.parent / "src"))
+
+_SAMPLE_DIR = _HERE.parents[4] / "gemini_api" / "img"
+_USER_SUB = "00000000-0000-0000-0000-000000000001"
+
+_CATEGORIES = ["tops", "bottoms", "outer"]
+_SUBS = ["t-shirt", "shirt/blouse", "knit/sweater", "denim/jeans", "slacks/pants", "skirt", "jacket/coat"]
+_COLORS = ["white", "black", "gray", "navy", "beige", "blue"]
+_LENGTHS = ["short", "half", "long"]
+_SEASONS = ["spring", "summer", "fall", "winter"]
+_SCENES = ["casual", "business", "feminine", "other"]
+
+_DETECTED = {
+    "detected_items": [
+        {"category": "tops", "subCategory": "t-shirt", "color": "white", "sleeveLength": "short",
+         "season": ["summer"], "scene": "casual"},
+        {"category": "bottoms", "subCategory": "denim/jeans", "color": "navy", "hemLength": "long",
+         "season": ["spring", "fall"], "scene": "casual"},
+    ]
+}
+
+
+# ---------------------------------------------------------------------------
+# Gemini stub
+
+
+class _GeminiStub(BaseHTTPRequestHandler):
+    delay_s = 0.0
+    slow_ratio = 0.0
+    slow_factor = 1.0
+    calls = 0
+    _rng = random.Random(0)
+    _lock = threading.Lock()
+
+    def log_message(self, *args):  # keep benchmark output clean
+        pass
+
+    def _send(self, payload):
+        raw = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_GET(self):
+        self._send({"models": [{"name": "models/gemini-1.5-flash-latest",
+                                "supportedGenerationMethods": ["generateContent"]}]})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        cls = type(self)
+        with cls._lock:
+            cls.calls += 1
+            slow = cls._rng.random() < cls.slow_ratio
+        text = json.dumps(_DETECTED, ensure_ascii=False)
+        if ":streamGenerateContent" not in self.path:
+            if self.delay_s:
+                time.sleep(self.delay_s * (self.slow_factor if slow else 1.0))
+            self._send({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+            return
+
+        # SSE: the delay is spread over 8 chunks, like tokens arriving over time.
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        step = -(-len(text) // 8)
+        for i in range(0, len(text), step):
+            if self.delay_s:
+                time.sleep(self.delay_s / 8)
+            chunk = {"candidates": [{"content": {"parts": [{"text": text[i : i + step]}]}}]}
+            self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\r\n\r\n")
+            self.wfile.flush()
+
+
+def _start_gemini_stub(delay_ms: float, slow_ratio: float = 0.0, slow_factor: float = 1.0) -> ThreadingHTTPServer:
+    _GeminiStub.delay_s = delay_ms / 1000.0
+    _GeminiStub.slow_ratio = slow_ratio
+    _GeminiStub.slow_factor = slow_factor
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _GeminiStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# DynamoDB / S3 stand-ins
+
+_SER = TypeSerializer()
+_DESER = TypeDeserializer()
+
+
+def _roundtrip(item):
+    return {k: _DESER.deserialize(_SER.serialize(v)) for k, v in item.items()}
+
+
+def _condition_failed():
+    return ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": "failed"}}, "Op")
+
+
+def _key_condition(cond):
+    """Split a boto3 Key condition into (hash name, hash value, range predicate)."""
+
+    expr = cond.get_expression()
+    if expr["operator"] == "AND":
+        left, right = expr["values"]
+        name, value, _ = _key_condition(left)
+        return name, value, _range_predicate(right)
+    key, value = expr["values"]
+    return key.name, value, None
+
+
+def _range_predicate(cond):
+    expr = cond.get_expression()
+    op, values = expr["operator"], expr["values"]
+    name = values[0].name
+    if op == "=":
+        return name, lambda v: v == values[1]
+    if op == "BETWEEN":
+        return name, lambda v: v is not None and values[1] <= v <= values[2]
+    if op == "begins_with":
+        return name, lambda v: isinstance(v, str) and v.startswith(values[1])
+    raise NotImplementedError(op)
+
+
+class _Table:
+    def __init__(self, name, hash_key, range_key, indexes=None):
+        self.name = name
+        self._hash = hash_key
+        self._range = range_key
+        self._indexes = indexes or {}
+        self._items = {}
+        self._sorted = {}
+
+    def _key(self, key):
+        return key[self._hash], key[self._range]
+
+    def _partition(self, hash_value):
+        rows = self._sorted.get(hash_value)
+        if rows is None:
+            rows = sorted((it for (h, _), it in self._items.items() if h == hash_value), key=lambda it: it[self._range])
+            self._sorted[hash_value] = rows
+        return rows
+
+    def _touch(self, key):
+        self._sorted.pop(key[0], None)
+
+    @staticmethod
+    def _project(item, projection, names):
+        if not projection:
+            return dict(item)
+        attrs = [(names or {}).get(p.strip(), p.strip()) for p in projection.split(",")]
+        return {a: item[a] for a in attrs if a in item}
+
+    def put_item(self, Item, ConditionExpression=None, **_):
+        key = self._key(Item)
+        if ConditionExpression and "attribute_not_exists" in ConditionExpression and key in self._items:
+            raise _condition_failed()
+        self._items[key] = _roundtrip(Item)
+        self._touch(key)
+        return {}
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **_):
+        item = self._items.get(self._key(Key))
+        if item is None:
+            return {}
+        return {"Item": self._project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    def delete_item(self, Key, ConditionExpression=None, **_):
+        key = self._key(Key)
+        if ConditionExpression and key not in self._items:
+            raise _condition_failed()
+        self._items.pop(key, None)
+        self._touch(key)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    ConditionExpression=None, ReturnValues=None, **_):
+        key = self._key(Key)
+        if ConditionExpression and key not in self._items:
+            raise _condition_failed()
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        item = dict(self._items.get(key) or dict(Key))
+        action, _, clauses = UpdateExpression.partition(" ")
+        for clause in clauses.split(","):
+            if action == "SET":
+                name, value = (p.strip() for p in clause.split("="))
+                item[names.get(name, name)] = values[value]
+            elif action == "ADD":
+                name, value = clause.split()
+                attr = names.get(name, name)
+                item[attr] = item.get(attr, 0) + values[value]
+            else:
+                raise NotImplementedError(action)
+        self._items[key] = _roundtrip(item)
+        self._touch(key)
+        return {"Attributes": dict(self._items[key])} if ReturnValues == "ALL_NEW" else {}
+
+    def query(self, KeyConditionExpression, IndexName=None, Limit=None, ExclusiveStartKey=None,
+              ScanIndexForward=True, ProjectionExpression=None, ExpressionAttributeNames=None, **_):
+        hash_name, hash_value, range_pred = _key_condition(KeyConditionExpression)
+        rows = self._partition(hash_value)
+        if IndexName:
+            index_range = self._indexes[IndexName]
+            rows = [it for it in rows if index_range in it]
+        if range_pred is not None:
+            attr, pred = range_pred
+            rows = [it for it in rows if pred(it.get(attr))]
+        if not ScanIndexForward:
+            rows = rows[::-1]
+        start = 0
+        if ExclusiveStartKey:
+            last = ExclusiveStartKey[self._range]
+            start = next((i + 1 for i, it in enumerate(rows) if it[self._range] == last), len(rows))
+        end = len(rows) if Limit is None else min(len(rows), start + Limit)
+        page = [self._project(it, ProjectionExpression, ExpressionAttributeNames) for it in rows[start:end]]
+        resp = {"Items": page, "Count": len(page)}
+        if end < len(rows):
+            last_item = rows[end - 1]
+            resp["LastEvaluatedKey"] = {self._hash: last_item[self._hash], self._range: last_item[self._range]}
+        return resp
+
+
+class _DynamoResource:
+    def __init__(self, tables):
+        self._tables = {t.name: t for t in tables}
+
+    def Table(self, name):
+        return self._tables[name]
+
+    def batch_write_item(self, RequestItems):
+        for name, requests in RequestItems.items():
+            table = self._tables[name]
+            for req in requests:
+                if "PutRequest" in req:
+                    table.put_item(Item=req["PutRequest"]["Item"])
+                else:
+                    table.delete_item(Key=req["DeleteRequest"]["Key"])
+        return {"UnprocessedItems": {}}
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self._tables[name]
+            found = [table.get_item(Key=k).get("Item") for k in request["Keys"]]
+            responses[name] = [it for it in found if it]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+
+class _DynamoClient:
+    """Only transact_write_items; applied in order, so not atomic (enough for timing)."""
+
+    def __init__(self, tables):
+        self._tables = {t.name: t for t in tables}
+        self._types = TypeDeserializer()
+
+    def transact_write_items(self, TransactItems):
+        for entry in TransactItems:
+            (action, params), = entry.items()
+            kwargs = dict(params)
+            table = self._tables[kwargs.pop("TableName")]
+            for name in ("Item", "Key", "ExpressionAttributeValues"):
+                if name in kwargs:
+                    kwargs[name] = {k: self._types.deserialize(v) for k, v in kwargs[name].items()}
+            {"Put": table.put_item, "Update": table.update_item, "Delete": table.delete_item}[action](**kwargs)
+        return {}
+
+
+class _S3:
+    def __init__(self, image):
+        self._image = image
+
+    def get_object(self, Bucket, Key):
+        # Trailing bytes after the JPEG end marker make every key hash differently.
+        body = self._image + Key.encode("utf-8")
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+
+def _sample_image() -> bytes:
+    paths = sorted(p for p in _SAMPLE_DIR.glob("*.*") if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if paths:
+        return paths[0].read_bytes()
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\xff\xd8\xff\xe0" + os.urandom(200_000)
+    buf = io.BytesIO()
+    Image.new("RGB", (1600, 1200), (180, 150, 120)).save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+
+
+def _percentile(sorted_ms, q):
+    if len(sorted_ms) == 1:
+        return sorted_ms[0]
+    return statistics.quantiles(sorted_ms, n=100, method="inclusive")[q - 1]
+
+
+def _make_event(base, method, path, *, query=None, body=None, headers=None, proxy=None):
+    event = copy.deepcopy(base)
+    event.update(
+        httpMethod=method,
+        path=path,
+        resource=path,
+        queryStringParameters=query,
+        pathParameters={"proxy": proxy} if proxy else None,
+        body=json.dumps(body) if body is not None else None,
+    )
+    event["headers"] = {**(event.get("headers") or {}), **(headers or {})}
+    return event
+
+
+def _seed(index, clothes, logs, size, rng):
+    ids = []
+    for _ in range(size):
+        payload = {
+            "category": rng.choice(_CATEGORIES),
+            "subCategory": rng.choice(_SUBS),
+            "color": rng.choice(_COLORS),
+            "sleeveLength": rng.choice(_LENGTHS),
+            "hemLength": rng.choice(_LENGTHS),
+            "season": rng.sample(_SEASONS, rng.randint(1, 3)),
+            "scene": rng.choice(_SCENES),
+            "imageUrl": f"public/clothes/{uuid.uuid4()}.jpg",
+            "name": "ベンチ用アイテム",
+        }
+        item = index._new_clothes_item(_USER_SUB, payload)
+        clothes.put_item(Item=item)
+        ids.append(item["clothesId"])
+    for d in range(30):
+        date = time.strftime("%Y-%m-%d", time.localtime(time.time() - d * 86400))
+        logs.put_item(Item={
+            "userId": _USER_SUB,
+            "logId": f"{date}#{uuid.uuid4()}",
+            "date": date,
+            "clothesIds": rng.sample(ids, min(3, len(ids))),
+            "createdAt": int(time.time()),
+        })
+    return ids
+
+
+def _routes(index, base, ids):
+    """(label, event factory, before-each hook) for one closet size."""
+
+    one_id = ids[len(ids) // 2]
+    list_event = _make_event(base, "GET", "/clothes")
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        etag = index.handler(list_event, None)["headers"].get("ETag", "")
+
+    def analyze():
+        return _make_event(base, "POST", "/analyze", body={"selfieKey": f"public/selfies/{uuid.uuid4()}.jpg"})
+
+    def reload_closet():
+        index._invalidate_closet_snapshot(_USER_SUB)
+
+    return [
+        ("GET /clothes", lambda: list_event, None),
+        ("GET /clothes 304", lambda: _make_event(base, "GET", "/clothes", headers={"If-None-Match": etag}), None),
+        ("GET /clothes?view=grid", lambda: _make_event(base, "GET", "/clothes", query={"view": "grid"}), None),
+        ("GET /clothes/{id}", lambda: _make_event(base, "GET", f"/clothes/{one_id}", proxy=one_id), None),
+        ("GET /logs?expand=clothes", lambda: _make_event(base, "GET", "/logs", query={"expand": "clothes"}), None),
+        ("POST /analyze", analyze, None),
+        ("POST /analyze (closet reload)", analyze, reload_closet),
+        ("POST /clothes", lambda: _make_event(base, "POST", "/clothes",
+                                               body={"category": "tops", "color": "white"}), None),
+    ]
+
+
+def _run_route(index, make_event, before, iterations, alloc_iterations):
+    # The handler's own log lines are part of its cost, but not of this report.
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        return _measure(index, make_event, before, iterations, alloc_iterations)
+
+
+def _measure(index, make_event, before, iterations, alloc_iterations):
+    samples = []
+    for _ in range(iterations):
+        if before:
+            before()
+        event = make_event()
+        t0 = time.perf_counter()
+        resp = index.handler(event, None)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+        if resp["statusCode"] >= 400:
+            raise RuntimeError(f"{event['httpMethod']} {event['path']} -> {resp['statusCode']}: {resp['body'][:200]}")
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(alloc_iterations):
+            if before:
+                before()
+            event = make_event()
+            base_mem, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            index.handler(event, None)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - base_mem)
+    finally:
+        tracemalloc.stop()
+
+    samples.sort()
+    return {
+        "p50": _percentile(samples, 50),
+        "p95": _percentile(samples, 95),
+        "p99": _percentile(samples, 99),
+        "peakKiB": statistics.median(peaks) / 1024.0 if peaks else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--alloc-iterations", type=int, default=5)
+    parser.add_argument("--gemini-delay-ms", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true", help="use streamGenerateContent (GEMINI_STREAM=1)")
+    parser.add_argument("--gemini-slow-ratio", type=float, default=0.0, help="fraction of Gemini calls in the slow tail")
+    parser.add_argument("--gemini-slow-factor", type=float, default=10.0, help="slow-tail delay multiplier")
+    parser.add_argument("--hedge", action="store_true", help="hedge slow Gemini calls (GEMINI_HEDGE=1)")
+    parser.add_argument("--hedge-delay-ms", type=float, default=None,
+                        help="GEMINI_HEDGE_DELAY_MS (default: 2x --gemini-delay-ms)")
+    args = parser.parse_args()
+
+    server = _start_gemini_stub(args.gemini_delay_ms, args.gemini_slow_ratio, args.gemini_slow_factor)
+    hedge_delay_ms = args.hedge_delay_ms if args.hedge_delay_ms is not None else 2 * args.gemini_delay_ms
+    os.environ.update(
+        AWS_DEFAULT_REGION="ap-northeast-1",
+        CLOTHES_TABLE_NAME="Clothes-bench",
+        WEARLOG_TABLE_NAME="WearingLog-bench",
+        SELFIE_BUCKET_NAME="selfies-bench",
+        GEMINI_API_KEY="bench",
+        GEMINI_API_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}",
+        TRACE_ENABLED="0",
+        GEMINI_STREAM="1" if args.stream else "0",
+        GEMINI_HEDGE="1" if args.hedge else "0",
+        GEMINI_HEDGE_DELAY_MS=str(hedge_delay_ms),
+    )
+    os.environ.pop("DETECTION_CACHE_TABLE_NAME", None)
+    os.environ.pop("ANALYZE_JOBS_TABLE_NAME", None)
+
+    import index
+
+    base = json.loads((_HERE.parent / "src" / "event.json").read_text(encoding="utf-8"))
+    image = _sample_image()
+    print(f"selfie {len(image) / 1024:.0f} KiB, gemini delay {args.gemini_delay_ms:.0f} ms"
+          f"{' (streamed)' if args.stream else ''}"
+          f"{f', {args.gemini_slow_ratio:.0%} slow x{args.gemini_slow_factor:g}' if args.gemini_slow_ratio else ''}"
+          f"{' (hedged)' if args.hedge else ''}, "
+          f"{args.iterations} iterations/route, orjson {'on' if index.orjson else 'off'}")
+
+    rng = random.Random(0)
+    for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+        clothes = _Table("Clothes-bench", "userId", "clothesId", {"byCategoryAndColor": "categoryColor"})
+        logs = _Table("WearingLog-bench", "userId", "logId")
+        index._AWS_TABLES.clear()
+        index._AWS_RESOURCES["dynamodb"] = _DynamoResource([clothes, logs])
+        index._AWS_CLIENTS["dynamodb"] = _DynamoClient([clothes, logs])
+        index._AWS_CLIENTS["s3"] = _S3(image)
+        index._CLOSET_SNAPSHOTS.clear()
+        ids = _seed(index, clothes, logs, size, rng)
+
+        print(f"\ncloset size {size}")
+        print(f"  {'route':<30} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak KiB':>9}")
+        for label, make_event, before in _routes(index, base, ids):
+            r = _run_route(index, make_event, before, args.iterations, args.alloc_iterations)
+            print(f"  {label:<30} {r['p50']:>8.2f} {r['p95']:>8.2f} {r['p99']:>8.2f} {r['peakKiB']:>9.1f}")
+
+    print(f"\ngemini calls {_GeminiStub.calls}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Gemini-style HTTPS calls: urlopen (new connection per call) vs the pooled _http_open.
+
+Runs a local HTTP/1.1 TLS stub (self-signed certificate made with the
+`openssl` CLI) that answers POSTs with a small JSON body. Loopback handshakes
+are nearly free, so the stub can add --rtt-ms per network round trip: two for
+each new connection (TCP + TLS 1.3 handshake) and one per request, roughly
+what a remote endpoint costs.
+
+    python bench/bench_http_pool.py [--calls 200] [--rtt-ms 0] [--body-kib 256]
+"""
+
+import argparse
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib import request as urllib_request
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+os.environ["TRACE_ENABLED"] = "0"
+
+import index  # noqa: E402
+
+_RESPONSE = json.dumps(
+    {"candidates": [{"content": {"parts": [{"text": json.dumps({"detected_items": []})}]}}]}
+).encode("utf-8")
+
+
+class _Stub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # like real servers; headers and body are separate writes
+    rtt_s = 0.0
+    handshakes = 0
+
+    def log_message(self, *args):  # keep benchmark output clean
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.rtt_s:
+            time.sleep(self.rtt_s)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(_RESPONSE)
+
+
+class _TLSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, context):
+        super().__init__(("127.0.0.1", 0), _Stub)
+        self.context = context
+
+    def finish_request(self, request, client_address):
+        # Handshake on the worker thread so a slow one does not block accept().
+        if _Stub.rtt_s:
+            time.sleep(2 * _Stub.rtt_s)
+        tls = self.context.wrap_socket(request, server_side=True)
+        _Stub.handshakes += 1
+        super().finish_request(tls, client_address)
+
+
+def _make_cert(workdir: str):
+    cert, key = os.path.join(workdir, "cert.pem"), os.path.join(workdir, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", key, "-out", cert, "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost"],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+def _percentile(sorted_ms, q):
+    if not sorted_ms:
+        return 0.0
+    return sorted_ms[min(len(sorted_ms) - 1, int(len(sorted_ms) * q / 100.0))]
+
+
+def _run(label, call, calls):
+    before = _Stub.handshakes
+    samples = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    samples.sort()
+    print(f"  {label:<22} {_percentile(samples, 50):>8.2f} {_percentile(samples, 95):>8.2f} "
+          f"{statistics.fmean(samples):>8.2f} {_Stub.handshakes - before:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=0.0)
+    parser.add_argument("--body-kib", type=int, default=256, help="request body size (base64 image)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        cert, key = _make_cert(workdir)
+        server_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_ctx.load_cert_chain(cert, key)
+        client_ctx = ssl.create_default_context(cafile=cert)
+
+        _Stub.rtt_s = args.rtt_ms / 1000.0
+        server = _TLSServer(server_ctx)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"https://127.0.0.1:{server.server_address[1]}/v1beta/models/m:generateContent?key=bench"
+        body = b'{"contents":"' + b"A" * (args.body_kib * 1024) + b'"}'
+        headers = {"Content-Type": "application/json"}
+
+        def via_urlopen():
+            req = urllib_request.Request(url, data=body, headers=headers, method="POST")
+            with urllib_request.urlopen(req, timeout=10, context=client_ctx) as resp:
+                resp.read()
+
+        index._HTTP_SSL_CONTEXT = client_ctx
+
+        def via_pool():
+            with index._http_open(url, method="POST", body=body, headers=headers, timeout=10) as resp:
+                resp.read()
+
+        print(f"{args.calls} sequential POSTs, {args.body_kib} KiB body, simulated rtt {args.rtt_ms:g} ms")
+        print(f"  {'client':<22} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8} {'handshakes':>11}")
+        _run("urlopen", via_urlopen, args.calls)
+        _run("_http_open (pooled)", via_pool, args.calls)
+        print(f"  pool stats {index._HTTP_POOL_STATS}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
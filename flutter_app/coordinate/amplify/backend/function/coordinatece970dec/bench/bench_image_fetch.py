@@ -0,0 +1,168 @@
+"""Peak memory of selfie download + Gemini upload: legacy one-shot path vs streamed.
+
+Legacy: resp.read(), full-resolution Pillow decode, base64 string, json.dumps
+and encode of the whole request. Streamed: _download_image_bytes (capped
+read), _preprocess_image (draft decode) and _gemini_detect_items (base64
+encoded slice by slice while sending). Each case runs in a fresh child
+process against a local stub serving the selfie and answering Gemini; the
+reported figure is the growth of peak RSS (VmHWM, reset first; Linux only)
+over the idle child, so Pillow's native buffers are included.
+
+    python bench/bench_image_fetch.py [--megapixels 3,12,24]
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib import request as urllib_request
+
+_HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(_HERE.parent / "src"))
+
+_RESPONSE = json.dumps(
+    {"candidates": [{"content": {"parts": [{"text": json.dumps({"detected_items": []})}]}}]}
+).encode("utf-8")
+
+
+class _Stub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    image_path = ""
+
+    def log_message(self, *args):  # keep benchmark output clean
+        pass
+
+    def do_GET(self):
+        # Served from disk in chunks so the stub itself adds no image-sized buffer.
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(os.path.getsize(self.image_path)))
+        self.end_headers()
+        with open(self.image_path, "rb") as f:
+            shutil.copyfileobj(f, self.wfile, 64 * 1024)
+
+    def do_POST(self):
+        remaining = int(self.headers.get("Content-Length") or 0)
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(_RESPONSE)
+
+
+def _legacy(index, image_url, gemini_url, preprocess):
+    with urllib_request.urlopen(image_url, timeout=20) as resp:
+        data = resp.read()
+    mime_type = "image/jpeg"
+    if preprocess:
+        from PIL import Image, ImageOps
+
+        with Image.open(io.BytesIO(data)) as img:
+            oriented = ImageOps.exif_transpose(img)
+            oriented.thumbnail((index._IMAGE_MAX_EDGE, index._IMAGE_MAX_EDGE), Image.LANCZOS)
+            out = io.BytesIO()
+            oriented.convert("RGB").save(out, format="JPEG", quality=index._IMAGE_JPEG_QUALITY, optimize=True)
+        data = out.getvalue()
+    image_b64 = base64.b64encode(data).decode("ascii")
+    body = {
+        "contents": [{"parts": [{"inline_data": {"mime_type": mime_type, "data": image_b64}},
+                                {"text": index._GEMINI_MASTER_PROMPT}]}],
+        "generationConfig": index._GEMINI_GENERATION_CONFIG,
+    }
+    req = urllib_request.Request(gemini_url, data=json.dumps(body).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    with urllib_request.urlopen(req, timeout=20) as resp:
+        resp.read()
+
+
+def _streamed(index, image_url, preprocess):
+    data = index._download_image_bytes(selfie_url=image_url, selfie_key=None)
+    mime_type = "image/jpeg"
+    if preprocess:
+        data, mime_type = index._preprocess_image(data)
+    index._gemini_detect_items(data, mime_type=mime_type)
+
+
+def _child(mode, image_path, preprocess):
+    os.environ.update(AWS_DEFAULT_REGION="ap-northeast-1", GEMINI_API_KEY="bench", TRACE_ENABLED="0",
+                      IMAGE_PREPROCESS="1" if preprocess else "0", IMAGE_MAX_BYTES=str(64 * 1024 * 1024))
+    import index
+
+    _Stub.image_path = image_path
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    index._GEMINI_API_BASE_URL = base
+    index._gemini_active_model = lambda: "bench"
+    import PIL.Image  # noqa: F401  (both paths pay for the import before the baseline)
+
+    before = _reset_peak_rss_kib()
+    if mode == "legacy":
+        _legacy(index, f"{base}/selfie.jpg", f"{base}/v1beta/models/bench:generateContent", preprocess)
+    else:
+        _streamed(index, f"{base}/selfie.jpg", preprocess)
+    print((_status_kib("VmHWM") - before) / 1024.0)
+
+
+def _status_kib(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise RuntimeError(f"{field} not in /proc/self/status")
+
+
+def _reset_peak_rss_kib():
+    # Linux: writing 5 to clear_refs resets VmHWM to the current RSS, so the
+    # peak below belongs to this run rather than to imports.
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    return _status_kib("VmRSS")
+
+
+def _make_jpeg(path, megapixels):
+    from PIL import Image
+
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    # Noise compresses poorly, like a worst-case camera photo.
+    Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(path, "JPEG", quality=90)
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "--child":
+        _child(sys.argv[2], sys.argv[3], sys.argv[4] == "1")
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megapixels", default="3,12,24")
+    args = parser.parse_args()
+
+    print(f"  {'image':<16} {'preprocess':<11} {'legacy MiB':>11} {'streamed MiB':>13}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for mp in (float(m) for m in args.megapixels.split(",") if m.strip()):
+            path = os.path.join(workdir, f"selfie-{mp:g}.jpg")
+            _make_jpeg(path, mp)
+            label = f"{mp:g} MP {os.path.getsize(path) / 2**20:.1f} MiB"
+            for preprocess in ("0", "1"):
+                peaks = []
+                for mode in ("legacy", "streamed"):
+                    out = subprocess.run([sys.executable, __file__, "--child", mode, path, preprocess],
+                                         check=True, capture_output=True, text=True).stdout
+                    peaks.append(float(out.strip().splitlines()[-1]))
+                print(f"  {label:<16} {'on' if preprocess == '1' else 'off':<11} {peaks[0]:>11.1f} {peaks[1]:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Gemini upload payload before/after selfie preprocessing.
+
+Always reports raw vs preprocessed size (base64 request body) and the time
+spent preprocessing. With GEMINI_API_KEY set, also calls Gemini with both
+variants and reports latency and whether the detected (category, color) sets
+agree.
+
+    python bench/bench_image_preprocess.py [image ...]
+
+Defaults to the sample images in gemini_api/img. Requires Pillow for the
+preprocessed variant to differ from the original.
+"""
+
+import base64
+import os
+import sys
+import time
+from pathlib import Path
+
+_HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(_HERE.parent / "src"))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+
+import index  # noqa: E402
+
+_SAMPLE_DIR = _HERE.parents[4] / "gemini_api" / "img"
+
+
+def _tags(items):
+    return sorted((it.get("category"), it.get("color")) for it in items)
+
+
+def _detect_timed(data: bytes, mime_type: str):
+    start = time.perf_counter()
+    items = index._gemini_detect_items(data, mime_type=mime_type)
+    return items, (time.perf_counter() - start) * 1000
+
+
+def main() -> None:
+    paths = [Path(p) for p in sys.argv[1:]] or sorted(_SAMPLE_DIR.glob("*.*"))
+    if index.Image is None:
+        print("Pillow is not installed: preprocessing only sniffs the MIME type.")
+    call_gemini = bool((os.environ.get("GEMINI_API_KEY") or "").strip())
+
+    total_raw = total_out = 0
+    for path in paths:
+        raw = path.read_bytes()
+        start = time.perf_counter()
+        out, mime_type = index._preprocess_image(raw)
+        prep_ms = (time.perf_counter() - start) * 1000
+
+        raw_b64 = len(base64.b64encode(raw))
+        out_b64 = len(base64.b64encode(out))
+        total_raw += raw_b64
+        total_out += out_b64
+        line = (
+            f"{path.name}: {raw_b64 / 1024:.0f}KiB -> {out_b64 / 1024:.0f}KiB "
+            f"({100 * out_b64 / raw_b64:.0f}%), {mime_type}, preprocess {prep_ms:.1f}ms"
+        )
+
+        if call_gemini:
+            before, before_ms = _detect_timed(raw, index._sniff_image_mime(raw))
+            after, after_ms = _detect_timed(out, mime_type)
+            agree = "agree" if _tags(before) == _tags(after) else f"DIFFER {_tags(before)} vs {_tags(after)}"
+            line += f", gemini {before_ms:.0f}ms -> {after_ms:.0f}ms, {agree}"
+        print(line)
+
+    if total_raw:
+        print(f"total: {total_raw / 1024:.0f}KiB -> {total_out / 1024:.0f}KiB ({100 * total_out / total_raw:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
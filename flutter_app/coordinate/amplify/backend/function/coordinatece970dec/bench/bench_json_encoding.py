@@ -0,0 +1,94 @@
+"""Response encoding: legacy json.dumps vs _json_dumps, plus gzip size/time.
+
+Encodes synthetic /clothes list bodies (100 to 5,000 items, numbers as
+Decimal like DynamoDB returns them) and checks both encoders produce the same
+JSON value.
+
+    python bench/bench_json_encoding.py [repeats]
+"""
+
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+
+import index  # noqa: E402
+
+_COLORS = ["white", "black", "gray", "navy", "beige", "blue"]
+_SEASONS = ["spring", "summer", "fall", "winter"]
+
+
+def _legacy_default(o):
+    if isinstance(o, set):
+        try:
+            return sorted(o)
+        except TypeError:
+            return list(o)
+    if isinstance(o, Decimal):
+        if o % 1 == 0:
+            return int(o)
+        return float(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _legacy_dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=_legacy_default)
+
+
+def _make_body(n, rng):
+    items = []
+    for i in range(n):
+        items.append(
+            {
+                "userId": "user-0001",
+                "clothesId": f"c{i:05d}",
+                "category": "tops",
+                "subCategory": "t-shirt",
+                "color": rng.choice(_COLORS),
+                "season": set(rng.sample(_SEASONS, 2)),
+                "name": f"お気に入りのシャツ {i}",
+                "imageUrl": f"https://example.com/clothes/{i}.jpg",
+                "wearCount": Decimal(rng.randint(0, 300)),
+                "score": Decimal(rng.randint(0, 9999)) / Decimal(100),
+                "createdAt": "2024-01-01T00:00:00+00:00",
+            }
+        )
+    return {"ok": True, "items": items, "nextToken": None}
+
+
+def _best_ms(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return min(samples), statistics.median(samples)
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = random.Random(0)
+    print(f"orjson: {'yes' if index.orjson is not None else 'no'}")
+    print(f"{'items':>6} {'legacy ms':>10} {'new ms':>8} {'raw KB':>8} {'gzip KB':>8} {'gzip ms':>8}")
+    for n in (100, 500, 1000, 5000):
+        body = _make_body(n, rng)
+        assert json.loads(_legacy_dumps(body)) == json.loads(index._json_dumps(body))
+        legacy, _ = _best_ms(lambda: _legacy_dumps(body), repeats)
+        new, _ = _best_ms(lambda: index._json_dumps(body), repeats)
+        raw = index._json_dumps(body).encode("utf-8")
+        gz_ms, _ = _best_ms(lambda: gzip.compress(raw, compresslevel=index._GZIP_LEVEL), repeats)
+        gz = gzip.compress(raw, compresslevel=index._GZIP_LEVEL)
+        print(f"{n:>6} {legacy:>10.2f} {new:>8.2f} {len(raw) / 1024:>8.1f} {len(gz) / 1024:>8.1f} {gz_ms:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Candidate scoring: legacy per-pair scorer vs the encoded snapshot engine.
+
+Builds synthetic closets (50 to 5,000 items), scores three detected items
+against every candidate and takes top-k, checking that both paths return the
+same ranking.
+
+    python bench/bench_scoring.py [repeats]
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+
+import index  # noqa: E402
+
+_CATEGORIES = ["tops", "bottoms", "outer"]
+_SUBS = ["t-shirt", "shirt/blouse", "knit/sweater", "denim/jeans", "slacks/pants", "skirt", "jacket/coat"]
+_COLORS = ["white", "black", "gray", "navy", "beige", "blue"]
+_LENGTHS = ["short", "half", "long"]
+_SEASONS = ["spring", "summer", "fall", "winter"]
+_SCENES = ["casual", "business", "feminine", "other"]
+
+
+def _legacy_score(detected, item):
+    """Scoring as it was before the snapshot engine (normalizes per call)."""
+
+    score = 0
+    for field, weight in (("subCategory", 50), ("sleeveLength", 20), ("hemLength", 20), ("scene", 10)):
+        d = index._norm_text(detected.get(field))
+        i = index._norm_text(item.get(field))
+        if d and i and d == i:
+            score += weight
+    if index._current_season_jst() in index._coerce_season_list(item.get("season")):
+        score += 10
+    return score
+
+
+def _closet(n, rng):
+    items = []
+    for i in range(n):
+        cat = rng.choice(_CATEGORIES)
+        col = rng.choice(_COLORS)
+        items.append(
+            {
+                "userId": "bench",
+                "clothesId": f"c{i:05d}",
+                "category": cat,
+                "color": col,
+                "categoryColor": f"{cat}#{col}",
+                "subCategory": rng.choice(_SUBS),
+                "sleeveLength": rng.choice(_LENGTHS),
+                "hemLength": rng.choice(_LENGTHS),
+                "scene": rng.choice(_SCENES),
+                "season": set(rng.sample(_SEASONS, rng.randint(1, 3))),
+            }
+        )
+    return items
+
+
+def _detected(rng):
+    return [
+        {
+            "category": cat,
+            "color": rng.choice(_COLORS),
+            "subCategory": rng.choice(_SUBS),
+            "sleeveLength": rng.choice(_LENGTHS),
+            "scene": rng.choice(_SCENES),
+        }
+        for cat in _CATEGORIES
+    ]
+
+
+def _legacy(snap, detected_items, top_k):
+    out = []
+    items = snap["items"]
+    for det in detected_items:
+        candidates = [items[p] for p in index._snapshot_candidates(snap, det["category"], det["color"])]
+        scored = [(_legacy_score(det, c), c) for c in candidates]
+        scored.sort(key=lambda t: t[0], reverse=True)
+        out.append([(s, c["clothesId"]) for s, c in scored[:top_k]])
+    return out
+
+
+def _engine(snap, detected_items, top_k):
+    season_bit = index._SEASON_BITS[index._current_season_jst()]
+    out = []
+    for det in detected_items:
+        res = index._match_detected(snap, det, top_k=top_k, season_bit=season_bit)
+        out.append([(c["score"], c["clothesId"]) for c in res["candidates"]])
+    return out
+
+
+def _time(fn, repeats):
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main() -> None:
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = random.Random(42)
+    # Silence the per-item "Analyze match" log lines.
+    index.print = lambda *a, **k: None
+
+    for n in (50, 500, 1000, 5000):
+        snap = index._build_closet_snapshot(_closet(n, rng))
+        detected = _detected(rng)
+        legacy_ms, legacy = _time(lambda: _legacy(snap, detected, 3), repeats)
+        engine_ms, engine = _time(lambda: _engine(snap, detected, 3), repeats)
+        same = "same ranking" if legacy == engine else "RANKING DIFFERS"
+        print(f"{n:>5} items: legacy {legacy_ms:7.2f}ms  engine {engine_ms:7.2f}ms  ({same})")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,82 +2,688 @@ import json
 import os
 import traceback
 import base64
+import contextlib
+import contextvars
+import copy
+import functools
+import gzip
+import hashlib
+import heapq
+import http.client
+import io
+import itertools
+import math
 import uuid
+import random
 import re
+import resource
+import socket
+import ssl
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from decimal import Decimal
 from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, List, Optional, Union
-from urllib import request as urllib_request
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 from urllib.error import URLError, HTTPError
+from urllib.parse import urljoin, urlsplit
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeSerializer
+
+# orjson is optional: a much faster encoder for large item lists when packaged.
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on deployment packaging
+    orjson = None
+
+# Pillow is optional: without it images are sent as uploaded (with the sniffed
+# MIME type) instead of being re-oriented, stripped and downsized.
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - depends on deployment packaging
+    Image = None
+    ImageOps = None
+else:
+    try:
+        from pillow_heif import register_heif_opener
+
+        register_heif_opener()
+    except ImportError:
+        pass
 
 
 _GEMINI_API_KEY_CACHE: Optional[str] = None
 
 
+# AWS resources/clients are expensive to build (session, service model loading,
+# endpoint resolution) and hold the connection pool. Keep one per container so
+# warm invocations reuse them instead of rebuilding on every request.
+_AWS_MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS") or "16")
+_AWS_RESOURCES: Dict[str, Any] = {}
+_AWS_CLIENTS: Dict[str, Any] = {}
+_AWS_TABLES: Dict[str, Any] = {}
+_AWS_LOCK = threading.Lock()
+
+
+# Keep-alive HTTP(S) connections for Gemini and selfieUrl fetches, reused across
+# warm invocations (urlopen sends "Connection: close", so every call used to pay
+# a TCP+TLS handshake). Idle sockets older than HTTP_POOL_IDLE_SECONDS are
+# dropped instead of reused; a reused socket the server already closed is
+# retried once on a fresh connection.
+_HTTP_POOL_MAX_IDLE_PER_HOST = int(os.environ.get("HTTP_POOL_MAX_IDLE_PER_HOST") or "4")
+_HTTP_POOL_IDLE_SECONDS = float(os.environ.get("HTTP_POOL_IDLE_SECONDS") or "50")
+_HTTP_POOL: Dict[Tuple[str, str, int], List[Tuple[http.client.HTTPConnection, float]]] = {}
+_HTTP_POOL_STATS = {"connections": 0, "reused": 0, "reconnects": 0}
+_HTTP_POOL_LOCK = threading.Lock()
+_HTTP_SSL_CONTEXT = ssl.create_default_context()
+_HTTP_MAX_REDIRECTS = 3
+
+
+# Per-user closet snapshots reused across warm invocations. Writes made through
+# this container invalidate immediately; writes from other containers become
+# visible once the TTL expires.
+_CLOSET_SNAPSHOT_TTL_SECONDS = float(os.environ.get("CLOSET_SNAPSHOT_TTL_SECONDS") or "60")
+_CLOSET_SNAPSHOT_MAX_USERS = int(os.environ.get("CLOSET_SNAPSHOT_MAX_USERS") or "256")
+_CLOSET_SNAPSHOTS: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_CLOSET_SNAPSHOT_LOCK = threading.Lock()
+# Invalidation generation per user (values from one increasing sequence): a load
+# only stores its snapshot if no write invalidated the user while it ran.
+# Evicted users fall back to the highest evicted value, which never matches a
+# generation read before the eviction.
+_CLOSET_GENERATIONS: "OrderedDict[str, int]" = OrderedDict()
+_CLOSET_GENERATION_SEQ = itertools.count(1)
+_CLOSET_GENERATION_FLOOR = 0
+
+
+# Background workers for /analyze (closet prefetch overlaps image fetch + Gemini).
+# Created once per container and reused across warm invocations.
+_ANALYZE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("ANALYZE_MAX_WORKERS") or "4"),
+    thread_name_prefix="analyze",
+)
+_ANALYZE_BATCH_MAX = int(os.environ.get("ANALYZE_BATCH_MAX") or "10")
+
+
+# Deadline propagation: each request gets the Lambda's remaining time minus a
+# safety margin (room to return an error); stages cap their timeouts to it.
+# API requests are also capped at the API Gateway integration timeout (29 s),
+# since the function Timeout is sized for the SQS worker, not for the client.
+_DEADLINE_SAFETY_MS = int(os.environ.get("DEADLINE_SAFETY_MS") or "1000")
+_API_GATEWAY_TIMEOUT_MS = int(os.environ.get("API_GATEWAY_TIMEOUT_MS") or "29000")
+_DEADLINE: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar("_DEADLINE", default=None)
+# Per-call Gemini cap: the API path must answer within the gateway limit, the
+# queue worker can wait for slow multi-item detections.
+_GEMINI_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_TIMEOUT_SECONDS") or "25")
+_GEMINI_WORKER_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_WORKER_TIMEOUT_SECONDS") or "100")
+_GEMINI_TIMEOUT: "contextvars.ContextVar[float]" = contextvars.ContextVar(
+    "_GEMINI_TIMEOUT", default=_GEMINI_TIMEOUT_SECONDS
+)
+
+
+# Hedged Gemini calls (GEMINI_HEDGE=1): when the first request is slower than
+# the recent GEMINI_HEDGE_PERCENTILE latency, a second one is fired (optionally
+# to GEMINI_HEDGE_MODEL) and the first success wins. Until enough latencies are
+# seen, GEMINI_HEDGE_DELAY_MS is used. Not combined with GEMINI_STREAM.
+_GEMINI_HEDGE_ENABLED = (os.environ.get("GEMINI_HEDGE") or "0") == "1"
+_GEMINI_HEDGE_PERCENTILE = float(os.environ.get("GEMINI_HEDGE_PERCENTILE") or "95")
+_GEMINI_HEDGE_DELAY_MS = float(os.environ.get("GEMINI_HEDGE_DELAY_MS") or "4000")
+_GEMINI_HEDGE_MODEL = (os.environ.get("GEMINI_HEDGE_MODEL") or "").strip()
+_GEMINI_HEDGE_MIN_SAMPLES = 20
+_GEMINI_LATENCIES: "deque[float]" = deque(maxlen=200)
+_GEMINI_LATENCY_LOCK = threading.Lock()
+# Separate from _ANALYZE_EXECUTOR: batch detection already runs on that pool.
+_GEMINI_HEDGE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("GEMINI_HEDGE_MAX_WORKERS") or "8"),
+    thread_name_prefix="gemini",
+)
+
+
+# Gemini back-pressure, per container. GEMINI_RATE_PER_SEC (0 = off) refills a
+# token bucket of GEMINI_RATE_BURST calls. Retryable failures (429, 5xx,
+# network errors, timeouts) are retried up to GEMINI_MAX_ATTEMPTS times with
+# full jitter. After GEMINI_BREAKER_FAILURES consecutive retryable failures the
+# circuit breaker opens for GEMINI_BREAKER_COOLDOWN_SECONDS; then one probe call
+# is let through (half-open) and its outcome closes or re-opens the breaker.
+# While Gemini is unavailable /analyze ranks the closet by season and recent
+# wear (ANALYZE_DEGRADED_MODE=1, the default) or fails fast with 503.
+_GEMINI_RATE_PER_SEC = float(os.environ.get("GEMINI_RATE_PER_SEC") or "0")
+_GEMINI_RATE_BURST = float(os.environ.get("GEMINI_RATE_BURST") or "5")
+_GEMINI_MAX_ATTEMPTS = int(os.environ.get("GEMINI_MAX_ATTEMPTS") or "3")
+_GEMINI_RETRY_BACKOFF_BASE_SECONDS = 0.5
+_GEMINI_RETRY_BACKOFF_MAX_SECONDS = 4.0
+_GEMINI_RETRYABLE_HTTP_CODES = frozenset({429, 500, 502, 503, 504})
+_GEMINI_BREAKER_FAILURES = int(os.environ.get("GEMINI_BREAKER_FAILURES") or "5")
+_GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("GEMINI_BREAKER_COOLDOWN_SECONDS") or "30")
+_GEMINI_GUARD_LOCK = threading.Lock()
+_GEMINI_BUCKET = {"tokens": _GEMINI_RATE_BURST, "updatedAt": time.monotonic()}
+_GEMINI_BREAKER = {"state": "closed", "failures": 0, "openedAt": 0.0}
+_ANALYZE_DEGRADED_MODE = (os.environ.get("ANALYZE_DEGRADED_MODE") or "1") != "0"
+# Degraded ranking: season match (season weight) plus this much per wear in
+# the current and previous month.
+_DEGRADED_WEAR_WEIGHT = 5
+
+
+# Async /analyze jobs. Without ANALYZE_JOBS_TABLE_NAME / ANALYZE_QUEUE_URL
+# (local runs) jobs are kept in memory and executed on _LOCAL_ANALYZE_JOB_EXECUTOR.
+_ANALYZE_JOB_TTL_SECONDS = int(os.environ.get("ANALYZE_JOB_TTL_SECONDS") or str(24 * 3600))
+_LOCAL_ANALYZE_JOBS: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_LOCAL_ANALYZE_JOBS_LOCK = threading.Lock()
+# Separate from _ANALYZE_EXECUTOR: a job blocks on the closet load it submits
+# there, so sharing the pool deadlocks once every worker runs a job.
+_LOCAL_ANALYZE_JOB_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="analyze-job")
+
+
+# Gemini detection results keyed by (model, prompt version, image hash).
+# Tier 1 is an in-process LRU; tier 2 is a DynamoDB table with TTL shared by all
+# containers (optional: skipped when DETECTION_CACHE_TABLE_NAME is not set).
+_DETECTION_CACHE_TTL_SECONDS = int(os.environ.get("DETECTION_CACHE_TTL_SECONDS") or str(7 * 24 * 3600))
+_DETECTION_CACHE_MAX_ENTRIES = int(os.environ.get("DETECTION_CACHE_MAX_ENTRIES") or "128")
+_DETECTION_CACHE: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+_DETECTION_CACHE_LOCK = threading.Lock()
+
+
+# Overridable so local stubs (bench/bench_handler.py) can stand in for the API.
+_GEMINI_API_BASE_URL = (os.environ.get("GEMINI_API_BASE_URL") or "https://generativelanguage.googleapis.com").rstrip("/")
+
+# GEMINI_STREAM=1 uses streamGenerateContent (SSE) and hands each detected item
+# to matching as soon as its JSON object is complete.
+_GEMINI_STREAM = (os.environ.get("GEMINI_STREAM") or "0") == "1"
+_GEMINI_STREAM_ITEMS_RE = re.compile(r'"(?:detected_items|items)"\s*:\s*\[')
+
+# GEMINI_MODEL -> (working fallback model, resolved at). Filled after a 404 so
+# later requests skip straight to the fallback until the TTL expires.
+_GEMINI_MODEL_TTL_SECONDS = float(os.environ.get("GEMINI_MODEL_TTL_SECONDS") or str(6 * 3600))
+_GEMINI_RESOLVED_MODELS: Dict[str, Tuple[str, float]] = {}
+_GEMINI_MODEL_LOCK = threading.Lock()
+
+
+# Selfie preprocessing before the Gemini upload.
+_IMAGE_PREPROCESS_ENABLED = (os.environ.get("IMAGE_PREPROCESS") or "1") != "0"
+_IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE") or "1024")
+_IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY") or "85")
+
+# Selfie downloads larger than IMAGE_MAX_BYTES are rejected: up front when the
+# Content-Length says so, otherwise as soon as the chunked read passes the cap.
+_IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES") or str(10 * 1024 * 1024))
+_IMAGE_READ_CHUNK_BYTES = 256 * 1024
+# The Gemini request body is streamed: the image is base64-encoded this many raw
+# bytes at a time (a multiple of 3, so slices encode independently) as it is sent.
+_GEMINI_BODY_CHUNK_BYTES = 3 * 64 * 1024
+_GEMINI_IMAGE_PLACEHOLDER = "__IMAGE_BASE64__"
+
+
+# Candidate scoring weights (additive, exact match on normalized tags):
+# subCategory +50, sleeveLength +20, hemLength +20, scene +10, and season +10
+# when the current season is in the item's seasons. Override with MATCH_WEIGHTS
+# (JSON object, e.g. {"scene": 15}).
+_MATCH_TAG_FIELDS = ("subCategory", "sleeveLength", "hemLength", "scene")
+_MATCH_WEIGHTS: Dict[str, int] = {
+    "subCategory": 50,
+    "sleeveLength": 20,
+    "hemLength": 20,
+    "scene": 10,
+    "season": 10,
+}
+try:
+    _MATCH_WEIGHTS.update(
+        {k: int(v) for k, v in json.loads(os.environ.get("MATCH_WEIGHTS") or "{}").items() if k in _MATCH_WEIGHTS}
+    )
+except (ValueError, TypeError, AttributeError) as e:
+    print("Ignoring invalid MATCH_WEIGHTS:", str(e))
+_SEASON_BITS = {"spring": 1, "summer": 2, "fall": 4, "winter": 8}
+_NO_MATCH_THRESHOLD = 20
+
+
+# Per-user monthly wear counters are stored in the WearingLog table under this logId prefix.
+_WEAR_STATS_PREFIX = "stats#"
+
+
+# Per-user collection versions behind list ETags, kept in one WearingLog item.
+# "version#" sorts after every date-prefixed logId and "stats#", so log queries skip it.
+_COLLECTION_VERSION_LOG_ID = "version#"
+_COLLECTION_VERSION_ATTRS = {"clothes": "clothesVersion", "logs": "logsVersion"}
+
+
+# Attributes clients may request with `fields=` on GET /clothes, and named views.
+_CLOTHES_PROJECTABLE_FIELDS = frozenset(
+    {
+        "clothesId",
+        "category",
+        "subCategory",
+        "color",
+        "sleeveLength",
+        "hemLength",
+        "season",
+        "scene",
+        "categoryColor",
+        "imageUrl",
+        "name",
+        "notes",
+        "createdAt",
+        "updatedAt",
+    }
+)
+# Stored for matching only; never part of an API response.
+_CLOTHES_INTERNAL_FIELDS = frozenset({"normTags"})
+_CLOTHES_VIEWS: Dict[str, Tuple[str, ...]] = {
+    # Home screen grid: just enough to render and open a tile.
+    "grid": ("clothesId", "imageUrl"),
+}
+
+
+# Per-request tracing, emitted as one CloudWatch Embedded Metric Format log line.
+_TRACE_ENABLED = (os.environ.get("TRACE_ENABLED") or "1") != "0"
+_TRACE_NAMESPACE = os.environ.get("TRACE_NAMESPACE") or "Coordinate/Api"
+_TRACE: "contextvars.ContextVar[Optional[Dict[str, Any]]]" = contextvars.ContextVar("_TRACE", default=None)
+_COLD_START = True
+
+
+# Response compression (see _compress_response). 0 disables it.
+_GZIP_MIN_BYTES = int(os.environ.get("RESPONSE_GZIP_MIN_BYTES") or "0")
+_GZIP_LEVEL = int(os.environ.get("RESPONSE_GZIP_LEVEL") or "5")
+
+
+# Bulk clothes import/delete (POST/DELETE /clothes/batch). BatchWriteItem takes
+# at most 25 requests and BatchGetItem 100 keys; unprocessed ones are retried
+# with jittered backoff.
+_CLOTHES_BATCH_MAX = int(os.environ.get("CLOTHES_BATCH_MAX") or "500")
+_DYNAMODB_BATCH_WRITE_SIZE = 25
+_DYNAMODB_BATCH_GET_SIZE = 100
+_DYNAMODB_BATCH_MAX_ATTEMPTS = int(os.environ.get("DYNAMODB_BATCH_MAX_ATTEMPTS") or "6")
+_DYNAMODB_BATCH_BACKOFF_BASE_SECONDS = 0.05
+_DYNAMODB_BATCH_BACKOFF_MAX_SECONDS = 2.0
+
+
+# Page size bounds for list endpoints (limit / nextToken).
+_QUERY_PAGE_MAX_LIMIT = 1000
+
+
 _DEFAULT_HEADERS = {
     "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Amz-User-Agent",
+    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Amz-User-Agent,If-None-Match",
     "Access-Control-Allow-Methods": "DELETE,GET,HEAD,OPTIONS,PATCH,POST,PUT",
+    "Access-Control-Expose-Headers": "ETag,Retry-After",
     "Content-Type": "application/json",
 }
 
 
-_GEMINI_MASTER_PROMPT = """
+# Canonical tag vocabulary shared by the Gemini prompt, write-time normalization
+# and matching. Keep in sync with lib/constants/clothes_options.dart.
+_MASTER_TAGS: Dict[str, Tuple[str, ...]] = {
+    "category": ("tops", "bottoms", "outer", "dress", "shoes"),
+    "subCategory": (
+        "t-shirt",
+        "shirt/blouse",
+        "knit/sweater",
+        "sweatshirt/hoodie",
+        "denim/jeans",
+        "slacks/pants",
+        "skirt",
+        "shorts",
+        "jacket/coat",
+        "cardigan",
+        "one-piece",
+        "setup",
+        "sneakers",
+        "leather/pumps",
+        "boots",
+        "sandals",
+    ),
+    "color": (
+        "white",
+        "black",
+        "gray",
+        "brown",
+        "beige",
+        "blue",
+        "navy",
+        "green",
+        "yellow",
+        "orange",
+        "red",
+        "pink",
+        "purple",
+        "gold",
+        "silver",
+        "denim",
+        "multi-color",
+    ),
+    "sleeveLength": ("short", "half", "long"),
+    "hemLength": ("short", "half", "long"),
+    "season": ("spring", "summer", "fall", "winter"),
+    "scene": ("casual", "business", "feminine", "other"),
+}
+
+# Synonyms -> canonical tag, per field. Canonical tags map to themselves; the
+# Japanese entries mirror the app's labels plus common kanji variants.
+_TAG_SYNONYMS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "category": {
+        "tops": ("top", "トップス", "シャツ", "t-shirt", "tshirt", "tee", "shirt", "blouse"),
+        "bottoms": ("bottom", "ボトムス", "パンツ", "ズボン", "skirt", "スカート"),
+        "outer": ("アウター", "コート", "ジャケット", "coat", "jacket"),
+        "dress": ("ワンピース",),
+        "shoes": ("shoe", "シューズ", "靴", "sneakers", "sneaker"),
+    },
+    "subCategory": {
+        "t-shirt": ("tシャツ",),
+        "shirt/blouse": ("シャツ/ブラウス",),
+        "knit/sweater": ("ニット/セーター",),
+        "sweatshirt/hoodie": ("スウェット/パーカー",),
+        "denim/jeans": ("デニム/ジーンズ",),
+        "slacks/pants": ("スラックス/パンツ",),
+        "skirt": ("スカート",),
+        "shorts": ("ショーツ",),
+        "jacket/coat": ("ジャケット/コート",),
+        "cardigan": ("カーディガン",),
+        "one-piece": ("ワンピース",),
+        "setup": ("セットアップ",),
+        "sneakers": ("スニーカー",),
+        "leather/pumps": ("レザー/パンプス",),
+        "boots": ("ブーツ",),
+        "sandals": ("サンダル",),
+    },
+    "color": {
+        "white": ("白",),
+        "black": ("黒",),
+        "gray": ("grey", "グレー", "灰"),
+        "brown": ("ブラウン", "茶"),
+        "beige": ("ベージュ",),
+        "blue": ("ブルー", "青"),
+        "navy": ("ネイビー", "紺"),
+        "green": ("グリーン", "緑"),
+        "yellow": ("イエロー", "黄"),
+        "orange": ("オレンジ",),
+        "red": ("レッド", "赤"),
+        "pink": ("ピンク",),
+        "purple": ("パープル", "紫"),
+        "gold": ("ゴールド", "金"),
+        "silver": ("シルバー", "銀"),
+        "denim": ("デニム",),
+        "multi-color": ("マルチ",),
+    },
+    "sleeveLength": {"short": ("半袖",), "half": ("五分袖",), "long": ("長袖",)},
+    "hemLength": {"short": ("短め",), "half": ("ミドル",), "long": ("長め",)},
+    "season": {"spring": ("春",), "summer": ("夏",), "fall": ("秋", "autumn"), "winter": ("冬",)},
+    "scene": {"casual": ("カジュアル",), "business": ("ビジネス",), "feminine": ("フェミニン",), "other": ("その他",)},
+}
+
+# O(1) exact lookups built once at import.
+_TAG_LOOKUP: Dict[str, Dict[str, str]] = {
+    field: {
+        **{tag: tag for tag in tags},
+        **{syn: canonical for canonical, syns in _TAG_SYNONYMS.get(field, {}).items() for syn in syns},
+    }
+    for field, tags in _MASTER_TAGS.items()
+}
+
+# Substring fallbacks for strings missing from _TAG_LOOKUP, in priority order.
+_CATEGORY_CONTAINS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("tops", ("トップ", "シャツ", "tshirt", "t-shirt", "shirt")),
+    ("bottoms", ("ボトム", "パンツ", "ズボン", "skirt")),
+    ("outer", ("アウター", "コート", "ジャケット", "outer")),
+    ("shoes", ("靴", "シュー", "shoe", "sneaker")),
+)
+_COLOR_CONTAINS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("navy", ("navy", "紺", "ネイビー")),
+    ("black", ("black", "黒", "ブラック")),
+    ("white", ("white", "白", "ホワイト")),
+    ("gray", ("gray", "grey", "グレー", "灰")),
+    ("beige", ("beige", "ベージュ")),
+    ("brown", ("brown", "茶", "ブラウン")),
+    ("blue", ("blue", "青", "ブルー")),
+    ("red", ("red", "赤", "レッド")),
+    ("green", ("green", "緑", "グリーン")),
+)
+
+# Bump when the vocabulary above changes so stored normTags are recomputed.
+_TAG_VOCAB_VERSION = 1
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_MASTER_TAG_LINES = "\n".join(f"- {field}: {', '.join(tags)}" for field, tags in _MASTER_TAGS.items())
+
+_GEMINI_MASTER_PROMPT = f"""
 あなたはファッション専門の画像解析AIです。
 送られた自撮り写真から「トップス」、「ボトムス」、「アウター」を特定し、指定されたマスタータグに従ってJSON形式で出力してください。
 
 # 厳守ルール
 - 以下のマスタータグは厳守し、以下に記載されていないタグを使用することは絶対にやめてください。
-- 検出できなかったアイテムや空のオブジェクト（{}）は、絶対に出力に含めないでください。
+- 検出できなかったアイテムや空のオブジェクト（{{}}）は、絶対に出力に含めないでください。
 - JSON形式以外のテキストは一切含めないでください。
 - 出力は純粋なJSONのみとし、Markdownのコードブロック（```json ... ```）は絶対に使用しないでください。
 
 
 # 厳守するマスタータグ定義
-- category: tops, bottoms, outer, dress, shoes
-- subCategory: t-shirt, shirt/blouse, knit/sweater, sweatshirt/hoodie, denim/jeans, slacks/pants, skirt, shorts, jacket/coat, cardigan, one-piece, setup, sneakers, leather/pumps, boots, sandals
-- color: white, black, gray, brown, beige, blue, navy, green, yellow, orange, red, pink, purple, gold, silver, denim, multi-color
-- sleeveLength: short, half, long
-- hemLength: short, half, long
-- season: spring, summer, fall, winter
-- scene: casual, business, feminine, other
+{_MASTER_TAG_LINES}
 
 # 出力形式 (JSON)
-{
+{{
     \"detected_items\": [
-        {
+        {{
             \"category\": \"tops\",
             \"subCategory\": \"t-shirt\",
             \"color\": \"white\",
             \"sleeveLength\": \"short\",
             \"season\": [\"spring\",\"summer\"],
             \"scene\": \"casual\"
-        }
+        }}
     ]
-}
+}}
 """.strip()
 
+# Structured output: Gemini must return JSON matching this schema, with every
+# tag restricted to the master vocabulary. GEMINI_STRUCTURED_OUTPUT=0 falls back
+# to prompt-only JSON for models without responseSchema support.
+_GEMINI_STRUCTURED_OUTPUT = (os.environ.get("GEMINI_STRUCTURED_OUTPUT") or "1") != "0"
+_GEMINI_MAX_OUTPUT_TOKENS = int(os.environ.get("GEMINI_MAX_OUTPUT_TOKENS") or "512")
+_GEMINI_RESPONSE_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {
+        "detected_items": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    field: (
+                        {"type": "ARRAY", "items": {"type": "STRING", "enum": list(tags)}}
+                        if field == "season"
+                        else {"type": "STRING", "enum": list(tags)}
+                    )
+                    for field, tags in _MASTER_TAGS.items()
+                },
+                "required": ["category", "color"],
+            },
+        }
+    },
+    "required": ["detected_items"],
+}
+_GEMINI_GENERATION_CONFIG: Dict[str, Any] = (
+    {
+        "responseMimeType": "application/json",
+        "responseSchema": _GEMINI_RESPONSE_SCHEMA,
+        "maxOutputTokens": _GEMINI_MAX_OUTPUT_TOKENS,
+    }
+    if _GEMINI_STRUCTURED_OUTPUT
+    else {}
+)
+
+# Bumps automatically whenever the prompt text or output config changes, so
+# cached detections produced by an older request shape are never served.
+_GEMINI_PROMPT_VERSION = hashlib.sha256(
+    (_GEMINI_MASTER_PROMPT + json.dumps(_GEMINI_GENERATION_CONFIG, sort_keys=True)).encode("utf-8")
+).hexdigest()[:12]
+
 
 def _json_default(o: Any):
-    if isinstance(o, set):
+    # Exact type checks first: this runs once per Decimal/set in every response.
+    t = type(o)
+    if t is Decimal or isinstance(o, Decimal):
+        # DynamoDB may return Decimal for numbers.
+        i = int(o)
+        return i if i == o else float(o)
+    if t is set or isinstance(o, (set, frozenset)):
         try:
             return sorted(o)
         except TypeError:
             return list(o)
-    if isinstance(o, Decimal):
-        # DynamoDB may return Decimal for numbers.
-        if o % 1 == 0:
-            return int(o)
-        return float(o)
     raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
 
 
+# Reused encoder (json.dumps builds a new one per call when `default` is given).
+_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, default=_json_default)
+
+
 def _json_dumps(value: Any) -> str:
-    return json.dumps(value, ensure_ascii=False, default=_json_default)
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=_json_default).decode("utf-8")
+        except TypeError:
+            # e.g. non-str dict keys or ints beyond 64 bits; stdlib handles those.
+            pass
+    return _JSON_ENCODER.encode(value)
+
+
+def _trace_begin(route: str, context) -> Optional[Dict[str, Any]]:
+    global _COLD_START
+    if not _TRACE_ENABLED:
+        return None
+    cold = _COLD_START
+    _COLD_START = False
+    return {
+        "origin": time.perf_counter(),
+        "route": route,
+        "requestId": getattr(context, "aws_request_id", None),
+        "coldStart": cold,
+        "stagesMs": {},
+        "counts": {},
+        "bytes": {},
+        "lock": threading.Lock(),
+    }
+
+
+@contextlib.contextmanager
+def _trace_stage(name: str):
+    """Add the block's wall time to stage `name` (repeated stages accumulate)."""
+
+    if _TRACE.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _trace_ms(name, (time.perf_counter() - start) * 1000.0)
+
+
+def _trace_ms(name: str, ms: float) -> None:
+    trace = _TRACE.get()
+    if trace is None:
+        return
+    with trace["lock"]:
+        trace["stagesMs"][name] = trace["stagesMs"].get(name, 0.0) + ms
+
+
+def _trace_count(name: str, n: int = 1, *, kind: str = "counts") -> None:
+    trace = _TRACE.get()
+    if trace is None:
+        return
+    with trace["lock"]:
+        trace[kind][name] = trace[kind].get(name, 0) + n
+
+
+def _trace_bytes(name: str, n: int) -> None:
+    _trace_count(name, n, kind="bytes")
+
+
+def _trace_set_route(route: str) -> None:
+    trace = _TRACE.get()
+    if trace is not None:
+        trace["route"] = route
+
+
+class _DeadlineExceeded(RuntimeError):
+    """The request's Lambda time budget is spent (mapped to HTTP 504)."""
+
+
+class _GeminiUnavailable(RuntimeError):
+    """Gemini is shed or failing; callers may retry after `retry_after` seconds (HTTP 503)."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _deadline_from_context(context, *, limit_ms: Optional[int] = None) -> Optional[float]:
+    get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if not callable(get_remaining):
+        return None
+    remaining = get_remaining()
+    if limit_ms is not None:
+        remaining = min(remaining, limit_ms)
+    return time.monotonic() + (remaining - _DEADLINE_SAFETY_MS) / 1000.0
+
+
+def _time_left(stage: str, cap: Optional[float] = None) -> Optional[float]:
+    """Seconds left for `stage`, at most `cap`; raises _DeadlineExceeded when none remain."""
+
+    deadline = _DEADLINE.get()
+    if deadline is None:
+        return cap
+    left = deadline - time.monotonic()
+    if left <= 0:
+        _trace_count("deadlineExceeded")
+        raise _DeadlineExceeded(f"Deadline exceeded before {stage}")
+    return left if cap is None else min(cap, left)
+
+
+def _submit_traced(fn: Callable[..., Any], *args, **kwargs):
+    # Executor threads do not inherit context variables; carry the trace and deadline along.
+    return _ANALYZE_EXECUTOR.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _trace_emit(trace: Dict[str, Any], status_code: Optional[int]) -> None:
+    """Print the trace as EMF: CloudWatch turns the listed keys into metrics by route."""
+
+    total_ms = (time.perf_counter() - trace["origin"]) * 1000.0
+    with trace["lock"]:
+        values: Dict[str, Any] = {f"{k}Ms": round(v, 2) for k, v in trace["stagesMs"].items()}
+        units = {k: "Milliseconds" for k in values}
+        for k, v in trace["counts"].items():
+            values[k] = v
+            units[k] = "Count"
+        for k, v in trace["bytes"].items():
+            values[k] = v
+            units[k] = "Bytes"
+    values["totalMs"] = round(total_ms, 2)
+    units["totalMs"] = "Milliseconds"
+    values["coldStart"] = 1 if trace["coldStart"] else 0
+    units["coldStart"] = "Count"
+    # ru_maxrss is in KiB on Linux.
+    values["maxRssMb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+    units["maxRssMb"] = "Megabytes"
+
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": _TRACE_NAMESPACE,
+                    "Dimensions": [["Route"]],
+                    "Metrics": [{"Name": k, "Unit": u} for k, u in units.items()],
+                }
+            ],
+        },
+        "Route": trace["route"],
+        "requestId": trace["requestId"],
+        "statusCode": status_code,
+        **values,
+    }
+    print(json.dumps(record, separators=(",", ":")))
 
 
 def _response(
@@ -89,12 +695,14 @@ def _response(
     if headers:
         merged_headers.update(headers)
 
-    if body is None:
-        body_json = ""
-    elif isinstance(body, (dict, list)):
-        body_json = _json_dumps(body)
-    else:
-        body_json = _json_dumps({"message": str(body)})
+    with _trace_stage("serialize"):
+        if body is None:
+            body_json = ""
+        elif isinstance(body, (dict, list)):
+            body_json = _json_dumps(body)
+        else:
+            body_json = _json_dumps({"message": str(body)})
+    _trace_bytes("responseBytes", len(body_json))
 
     return {
         "statusCode": status_code,
@@ -132,18 +740,334 @@ def _get_user_id(event) -> Optional[str]:
     return identity.get("cognitoIdentityId")
 
 
+def _aws_config() -> Config:
+    return Config(
+        max_pool_connections=_AWS_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        retries={"max_attempts": 3, "mode": "standard"},
+    )
+
+
+def _get_aws_resource(service_name: str):
+    res = _AWS_RESOURCES.get(service_name)
+    if res is not None:
+        return res
+    with _AWS_LOCK:
+        res = _AWS_RESOURCES.get(service_name)
+        if res is None:
+            res = boto3.resource(service_name, config=_aws_config())
+            _AWS_RESOURCES[service_name] = res
+    return res
+
+
+def _get_aws_client(service_name: str):
+    client = _AWS_CLIENTS.get(service_name)
+    if client is not None:
+        return client
+    with _AWS_LOCK:
+        client = _AWS_CLIENTS.get(service_name)
+        if client is None:
+            client = boto3.client(service_name, config=_aws_config())
+            _AWS_CLIENTS[service_name] = client
+    return client
+
+
+def _get_dynamodb_table(table_name: str):
+    table = _AWS_TABLES.get(table_name)
+    if table is None:
+        table = _get_aws_resource("dynamodb").Table(table_name)
+        _AWS_TABLES[table_name] = table
+    return table
+
+
 def _get_table():
     table_name = os.environ.get("CLOTHES_TABLE_NAME")
     if not table_name:
         raise RuntimeError("CLOTHES_TABLE_NAME is not set")
-    return boto3.resource("dynamodb").Table(table_name)
+    return _get_dynamodb_table(table_name)
 
 
 def _get_wearlog_table():
     table_name = os.environ.get("WEARLOG_TABLE_NAME")
     if not table_name:
         raise RuntimeError("WEARLOG_TABLE_NAME is not set")
-    return boto3.resource("dynamodb").Table(table_name)
+    return _get_dynamodb_table(table_name)
+
+
+def _warm_up() -> None:
+    """Build the pooled AWS resources/clients ahead of the first request.
+
+    Runs automatically during Lambda init (which is not billed against request
+    latency); can also be called explicitly, e.g. from a scheduled ping.
+    """
+
+    _get_aws_resource("dynamodb")
+    _get_aws_client("s3")
+    if (os.environ.get("ANALYZE_QUEUE_URL") or "").strip():
+        _get_aws_client("sqs")
+    if not (os.environ.get("GEMINI_API_KEY") or "").strip():
+        _get_aws_client("ssm")
+    for env_name in ("CLOTHES_TABLE_NAME", "WEARLOG_TABLE_NAME"):
+        table_name = os.environ.get(env_name)
+        if table_name:
+            _get_dynamodb_table(table_name)
+
+
+def _reset_aws_clients() -> None:
+    """Drop pooled AWS resources/clients (forces a cold rebuild; used by benchmarks)."""
+
+    with _AWS_LOCK:
+        _AWS_RESOURCES.clear()
+        _AWS_CLIENTS.clear()
+        _AWS_TABLES.clear()
+
+
+def _iter_query_pages(table, **query_kwargs) -> Iterator[Dict[str, Any]]:
+    """Yield every DynamoDB query page, following LastEvaluatedKey until exhausted."""
+
+    kwargs = dict(query_kwargs)
+    while True:
+        _time_left("dynamodb query")
+        with _trace_stage("ddbQuery"):
+            resp = table.query(**kwargs)
+        _trace_count("ddbQueries")
+        yield resp
+        last_key = resp.get("LastEvaluatedKey")
+        if not last_key:
+            return
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def _iter_query_items(table, **query_kwargs) -> Iterator[Dict[str, Any]]:
+    for page in _iter_query_pages(table, **query_kwargs):
+        yield from page.get("Items") or []
+
+
+def _query_page(
+    table,
+    *,
+    limit: int,
+    exclusive_start_key: Optional[Dict[str, Any]] = None,
+    **query_kwargs,
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Collect up to `limit` items, continuing across 1 MB pages if needed.
+
+    Returns (items, last_evaluated_key); the key is None once the result set is exhausted.
+    """
+
+    items: List[Dict[str, Any]] = []
+    kwargs = dict(query_kwargs)
+    if exclusive_start_key:
+        kwargs["ExclusiveStartKey"] = exclusive_start_key
+    last_key: Optional[Dict[str, Any]] = None
+    while len(items) < limit:
+        kwargs["Limit"] = limit - len(items)
+        _time_left("dynamodb query")
+        with _trace_stage("ddbQuery"):
+            resp = table.query(**kwargs)
+        _trace_count("ddbQueries")
+        items.extend(resp.get("Items") or [])
+        last_key = resp.get("LastEvaluatedKey")
+        if not last_key:
+            return items, None
+        kwargs["ExclusiveStartKey"] = last_key
+    return items, last_key
+
+
+def _encode_next_token(last_key: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not last_key:
+        return None
+    raw = _json_dumps(last_key).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_next_token(token: Optional[str], user_id: str) -> Optional[Dict[str, Any]]:
+    if not isinstance(token, str) or not token.strip():
+        return None
+    token = token.strip()
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid nextToken")
+    # Tokens are opaque to clients, but never let one point into another user's partition.
+    if not isinstance(key, dict) or key.get("userId") != user_id:
+        raise ValueError("Invalid nextToken")
+    return key
+
+
+def _parse_limit(value: Any) -> int:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return _QUERY_PAGE_MAX_LIMIT
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    return min(limit, _QUERY_PAGE_MAX_LIMIT)
+
+
+def _get_header(event, name: str) -> Optional[str]:
+    # API Gateway keeps the client's header casing.
+    name = name.lower()
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name and isinstance(value, str):
+            return value
+    return None
+
+
+def _http_pool_key(url: str) -> Tuple[str, str, int]:
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise URLError(f"unsupported URL: {url[:100]}")
+    return parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)
+
+
+def _http_checkout(key: Tuple[str, str, int], timeout: Optional[float]) -> Optional[http.client.HTTPConnection]:
+    """Most recently used idle connection for `key`, or None."""
+
+    now = time.monotonic()
+    stale = []
+    conn = None
+    with _HTTP_POOL_LOCK:
+        idle = _HTTP_POOL.get(key) or []
+        while idle:
+            candidate, idle_since = idle.pop()
+            if now - idle_since < _HTTP_POOL_IDLE_SECONDS:
+                conn = candidate
+                _HTTP_POOL_STATS["reused"] += 1
+                break
+            stale.append(candidate)
+    for old in stale:
+        old.close()
+    if conn is not None:
+        _trace_count("httpConnReused")
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+    return conn
+
+
+def _http_connect(key: Tuple[str, str, int], timeout: Optional[float]) -> http.client.HTTPConnection:
+    scheme, host, port = key
+    if scheme == "https":
+        conn: http.client.HTTPConnection = http.client.HTTPSConnection(
+            host, port, timeout=timeout, context=_HTTP_SSL_CONTEXT
+        )
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    with _trace_stage("httpConnect"):
+        conn.connect()
+    # Headers and a large or streamed body go out in several writes; don't let
+    # Nagle hold the tail back waiting for a delayed ACK.
+    conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    with _HTTP_POOL_LOCK:
+        _HTTP_POOL_STATS["connections"] += 1
+    _trace_count("httpConnNew")
+    return conn
+
+
+def _http_release(key: Tuple[str, str, int], conn: http.client.HTTPConnection, resp: http.client.HTTPResponse) -> None:
+    """Pool `conn` if its response was read to the end and the server keeps it open."""
+
+    if resp.isclosed() and not resp.will_close and conn.sock is not None:
+        with _HTTP_POOL_LOCK:
+            idle = _HTTP_POOL.setdefault(key, [])
+            if any(pooled is conn for pooled, _ in idle):
+                return  # never hand one socket out twice
+            if len(idle) < _HTTP_POOL_MAX_IDLE_PER_HOST:
+                idle.append((conn, time.monotonic()))
+                return
+    conn.close()
+
+
+_HttpBody = Union[bytes, Callable[[], Iterator[bytes]], None]
+
+
+def _http_send(
+    key: Tuple[str, str, int],
+    method: str,
+    target: str,
+    body: _HttpBody,
+    headers: Dict[str, str],
+    timeout: Optional[float],
+) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+    conn = _http_checkout(key, timeout)
+    if conn is not None:
+        try:
+            conn.request(method, target, body=body() if callable(body) else body, headers=headers)
+            return conn, conn.getresponse()
+        except (ConnectionResetError, BrokenPipeError, http.client.BadStatusLine):
+            # The server dropped the idle socket (RemoteDisconnected is both);
+            # nothing was answered, so go again on a fresh connection.
+            conn.close()
+            with _HTTP_POOL_LOCK:
+                _HTTP_POOL_STATS["reconnects"] += 1
+            _trace_count("httpReconnects")
+        except BaseException:
+            conn.close()
+            raise
+
+    conn = _http_connect(key, timeout)
+    try:
+        conn.request(method, target, body=body() if callable(body) else body, headers=headers)
+        return conn, conn.getresponse()
+    except BaseException:
+        conn.close()
+        raise
+
+
+@contextlib.contextmanager
+def _http_open(
+    url: str,
+    *,
+    method: str = "GET",
+    body: _HttpBody = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None,
+) -> Iterator[http.client.HTTPResponse]:
+    """`urlopen` over pooled keep-alive connections.
+
+    Yields the response; its connection goes back to the pool if the body was
+    read to the end. Errors surface like urlopen's: HTTPError for status >= 400,
+    TimeoutError for timeouts and URLError for other connection failures.
+    GET redirects are followed. `body` may be a callable returning an iterator
+    of chunks (called once per attempt; pass Content-Length in `headers`).
+    """
+
+    for _ in range(_HTTP_MAX_REDIRECTS + 1):
+        key = _http_pool_key(url)
+        parts = urlsplit(url)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        try:
+            conn, resp = _http_send(key, method, target, body, dict(headers or {}), timeout)
+        except TimeoutError:
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            raise URLError(e)
+
+        location = resp.getheader("Location")
+        if method == "GET" and resp.status in (301, 302, 303, 307, 308) and location:
+            resp.read()
+            _http_release(key, conn, resp)
+            url = urljoin(url, location)
+            continue
+        break
+    else:
+        # Every response so far was a redirect (and its connection is released).
+        raise URLError(f"too many redirects (> {_HTTP_MAX_REDIRECTS})")
+
+    if resp.status >= 400:
+        # Error bodies are small; read it so the connection can be reused.
+        raw = resp.read()
+        _http_release(key, conn, resp)
+        raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(raw))
+
+    try:
+        yield resp
+    finally:
+        _http_release(key, conn, resp)
 
 
 def _get_api_path(event) -> str:
@@ -155,12 +1079,44 @@ def _get_api_path(event) -> str:
 
 
 def _download_image_bytes(*, selfie_url: Optional[str], selfie_key: Optional[str]) -> bytes:
+    with _trace_stage("download"):
+        data = _fetch_image_bytes(selfie_url=selfie_url, selfie_key=selfie_key)
+    _trace_bytes("imageBytes", len(data))
+    return data
+
+
+def _read_image_capped(stream, content_length: Optional[int]) -> bytes:
+    """Read an image body of at most IMAGE_MAX_BYTES without buffering past the cap."""
+
+    if content_length is not None:
+        if content_length > _IMAGE_MAX_BYTES:
+            _trace_count("imageRejected")
+            raise ValueError(f"Image is too large: {content_length} bytes (limit {_IMAGE_MAX_BYTES})")
+        # Known size within the cap: one read, one allocation.
+        return stream.read()
+
+    chunks: List[bytes] = []
+    total = 0
+    while True:
+        chunk = stream.read(_IMAGE_READ_CHUNK_BYTES)
+        if not chunk:
+            return b"".join(chunks)
+        total += len(chunk)
+        if total > _IMAGE_MAX_BYTES:
+            _trace_count("imageRejected")
+            raise ValueError(f"Image is too large: over {_IMAGE_MAX_BYTES} bytes")
+        chunks.append(chunk)
+
+
+def _fetch_image_bytes(*, selfie_url: Optional[str], selfie_key: Optional[str]) -> bytes:
     if selfie_url and selfie_url.strip():
         url = selfie_url.strip()
         try:
-            req = urllib_request.Request(url, headers={"User-Agent": "amplify-lambda"})
-            with urllib_request.urlopen(req, timeout=20) as resp:
-                return resp.read()
+            with _http_open(
+                url, headers={"User-Agent": "amplify-lambda"}, timeout=_time_left("download", 20)
+            ) as resp:
+                length = (resp.getheader("Content-Length") or "").strip()
+                return _read_image_capped(resp, int(length) if length.isdigit() else None)
         except HTTPError as e:
             raise RuntimeError(f"Failed to fetch selfieUrl: HTTP {e.code}")
         except URLError as e:
@@ -170,10 +1126,12 @@ def _download_image_bytes(*, selfie_url: Optional[str], selfie_key: Optional[str
         bucket = (os.environ.get("SELFIE_BUCKET_NAME") or "").strip()
         if not bucket:
             raise RuntimeError("SELFIE_BUCKET_NAME is not set (or pass selfieUrl)")
-        s3 = boto3.client("s3")
+        s3 = _get_aws_client("s3")
         try:
+            _time_left("download")
             obj = s3.get_object(Bucket=bucket, Key=selfie_key.strip())
-            return obj["Body"].read()
+            with contextlib.closing(obj["Body"]) as body:
+                return _read_image_capped(body, obj.get("ContentLength"))
         except ClientError as e:
             raise RuntimeError(f"Failed to fetch S3 object: {str(e)}")
 
@@ -205,7 +1163,7 @@ def _get_gemini_api_key() -> str:
         )
 
     try:
-        ssm = boto3.client("ssm")
+        ssm = _get_aws_client("ssm")
         resp = ssm.get_parameter(Name=param_name, WithDecryption=True)
         value = (((resp or {}).get("Parameter") or {}).get("Value") or "").strip()
         if not value:
@@ -216,21 +1174,541 @@ def _get_gemini_api_key() -> str:
         raise RuntimeError(f"Failed to read SSM parameter {param_name}: {str(e)}")
 
 
-def _gemini_detect_items(image_bytes: bytes) -> List[Dict[str, Any]]:
-    api_key = _get_gemini_api_key()
+def _gemini_model_name() -> str:
+    return (os.environ.get("GEMINI_MODEL") or "gemini-1.5-flash-latest").strip()
+
+
+def _gemini_list_models(api_key: str) -> List[Dict[str, Any]]:
+    url = f"{_GEMINI_API_BASE_URL}/v1beta/models?key={api_key}"
+    with _http_open(
+        url, headers={"Content-Type": "application/json"}, timeout=_time_left("gemini model lookup", 20)
+    ) as resp:
+        raw = resp.read().decode("utf-8")
+    decoded = json.loads(raw)
+    models = decoded.get("models")
+    if isinstance(models, list):
+        return [m for m in models if isinstance(m, dict)]
+    return []
+
+
+def _supports_generate_content(model_obj: Dict[str, Any]) -> bool:
+    methods = model_obj.get("supportedGenerationMethods")
+    if not isinstance(methods, list):
+        return False
+    return any(isinstance(m, str) and m == "generateContent" for m in methods)
+
+
+def _pick_fallback_model(models: List[Dict[str, Any]], exclude: Optional[str] = None) -> Optional[str]:
+    names = []
+    for m in models:
+        if not _supports_generate_content(m):
+            continue
+        name = m.get("name")
+        if isinstance(name, str) and name.startswith("models/"):
+            name = name.replace("models/", "", 1)
+        if isinstance(name, str) and name != exclude:
+            names.append(name)
+
+    if not names:
+        return None
+
+    prefer = [
+        "gemini-2.0-flash",
+        "gemini-2.0-flash-lite",
+        "gemini-1.5-flash-latest",
+        "gemini-1.5-flash",
+        "gemini-1.5-pro-latest",
+        "gemini-1.5-pro",
+        "gemini-pro",
+    ]
+    for p in prefer:
+        if p in names:
+            return p
+
+    # Otherwise, just pick the first available generateContent-capable model.
+    return names[0]
+
+
+def _gemini_active_model() -> str:
+    """Model to call: the memoized fallback while fresh, otherwise GEMINI_MODEL.
+
+    After the TTL the configured model is tried again, so a fixed config or a
+    restored model is picked up without redeploying.
+    """
+
+    configured = _gemini_model_name()
+    memo = _GEMINI_RESOLVED_MODELS.get(configured)
+    if memo and time.monotonic() - memo[1] < _GEMINI_MODEL_TTL_SECONDS:
+        return memo[0]
+    return configured
+
+
+def _gemini_model_persist_key(configured: str) -> str:
+    return f"gemini-model#{configured}"
+
+
+def _load_persisted_gemini_model(configured: str) -> Optional[str]:
+    table = _get_detection_cache_table()
+    if table is None:
+        return None
+    try:
+        item = table.get_item(Key={"cacheKey": _gemini_model_persist_key(configured)}).get("Item")
+    except ClientError as e:
+        print("Gemini model lookup failed:", str(e))
+        return None
+    if not item or int(item.get("expiresAt") or 0) <= _now_epoch_seconds():
+        return None
+    model = item.get("model")
+    return model if isinstance(model, str) and model else None
+
+
+def _persist_gemini_model(configured: str, model: str) -> None:
+    table = _get_detection_cache_table()
+    if table is None:
+        return
+    try:
+        table.put_item(
+            Item={
+                "cacheKey": _gemini_model_persist_key(configured),
+                "model": model,
+                "createdAt": _now_epoch_seconds(),
+                "expiresAt": _now_epoch_seconds() + int(_GEMINI_MODEL_TTL_SECONDS),
+            }
+        )
+    except ClientError as e:
+        print("Gemini model persist failed:", str(e))
+
+
+def _gemini_rediscover_model(api_key: str, *, failed_model: str) -> str:
+    """Pick a working model after `failed_model` returned 404.
+
+    Memoized per container and persisted in the detection cache table, so a
+    deprecated GEMINI_MODEL costs one discovery round trip instead of a
+    list-models call on every request.
+    """
+
+    configured = _gemini_model_name()
+    with _GEMINI_MODEL_LOCK:
+        # Another worker may have resolved it while we waited for the lock.
+        memo = _GEMINI_RESOLVED_MODELS.get(configured)
+        if memo and memo[0] != failed_model and time.monotonic() - memo[1] < _GEMINI_MODEL_TTL_SECONDS:
+            return memo[0]
+
+        chosen = _load_persisted_gemini_model(configured)
+        source = "persisted"
+        if not chosen or chosen == failed_model:
+            models = _gemini_list_models(api_key)
+            chosen = _pick_fallback_model(models, exclude=failed_model)
+            source = "listModels"
+            if not chosen:
+                available = []
+                for m in models[:25]:
+                    n = m.get("name")
+                    if isinstance(n, str):
+                        available.append(n)
+                raise RuntimeError(
+                    "Gemini model not found and no generateContent-capable models available. "
+                    f"Set GEMINI_MODEL to a valid model. Available (sample): {available}"
+                )
+            _persist_gemini_model(configured, chosen)
+
+        _GEMINI_RESOLVED_MODELS[configured] = (chosen, time.monotonic())
+        print("Gemini model resolved", {"configured": configured, "model": chosen, "source": source})
+        return chosen
+
+
+def _sniff_image_mime(data: bytes) -> str:
+    """Detect the real image type from magic bytes (uploads are not always JPEG)."""
+
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp":
+        brand = data[8:12]
+        if brand in (b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1", b"heif"):
+            return "image/heif"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/jpeg"
+
+
+def _preprocess_image(image_bytes: bytes) -> Tuple[bytes, str]:
+    """Return (bytes, mime_type) to upload to Gemini.
+
+    With Pillow available: apply EXIF orientation, drop metadata, downsize to
+    IMAGE_MAX_EDGE and re-encode as JPEG at IMAGE_JPEG_QUALITY. The original is
+    kept when re-encoding would not help (already small, correctly oriented).
+    """
+
+    mime_type = _sniff_image_mime(image_bytes)
+    if Image is None or not _IMAGE_PREPROCESS_ENABLED:
+        return image_bytes, mime_type
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            resized = max(img.size) > _IMAGE_MAX_EDGE
+            # JPEGs decode directly at 1/2, 1/4 or 1/8 scale (still >= the target
+            # edge), so a 12 MP photo never exists in memory at full resolution.
+            img.draft("RGB", (_IMAGE_MAX_EDGE, _IMAGE_MAX_EDGE))
+            orientation = img.getexif().get(0x0112, 1)
+            oriented = ImageOps.exif_transpose(img)
+            if resized:
+                oriented.thumbnail((_IMAGE_MAX_EDGE, _IMAGE_MAX_EDGE), Image.LANCZOS)
+            if oriented.mode != "RGB":
+                oriented = oriented.convert("RGB")
+
+            out = io.BytesIO()
+            # No exif= argument: metadata (GPS, device info) is not carried over.
+            oriented.save(out, format="JPEG", quality=_IMAGE_JPEG_QUALITY, optimize=True)
+    except Exception as e:
+        # Unknown/undecodable format: let Gemini try the original.
+        print("Image preprocess skipped:", f"{type(e).__name__}: {e}")
+        return image_bytes, mime_type
+
+    processed = out.getvalue()
+    if resized or orientation != 1 or mime_type not in ("image/jpeg", "image/png", "image/webp"):
+        return processed, "image/jpeg"
+    if len(processed) < len(image_bytes):
+        return processed, "image/jpeg"
+    return image_bytes, mime_type
+
+
+def _iter_gemini_sse_text(resp, texts: List[str]) -> Iterator[str]:
+    """Yield the text parts of each streamGenerateContent SSE event as it arrives.
+
+    Every part is also appended to `texts` so the caller can rebuild the full output.
+    """
+
+    for raw_line in resp:
+        line = raw_line.decode("utf-8").strip()
+        if not line.startswith("data:"):
+            continue
+        chunk = json.loads(line[5:].strip())
+        candidates = chunk.get("candidates") or []
+        parts = (((candidates[0] or {}).get("content") or {}).get("parts") or []) if candidates else []
+        for p in parts:
+            if isinstance(p, dict) and isinstance(p.get("text"), str):
+                texts.append(p["text"])
+                yield p["text"]
+
+
+def _iter_streamed_items(fragments: Iterator[str]) -> Iterator[Any]:
+    """Yield each object of the first "detected_items" (or "items") array once it is complete.
+
+    Fragments may split the JSON anywhere; braces inside strings are skipped.
+    Stops at the closing bracket without draining `fragments`.
+    """
+
+    buf = ""
+    pos = 0
+    in_array = False
+    depth = 0
+    start = -1
+    in_str = False
+    esc = False
+    for fragment in fragments:
+        buf += fragment
+        if not in_array:
+            m = _GEMINI_STREAM_ITEMS_RE.search(buf)
+            if not m:
+                continue
+            in_array = True
+            pos = m.end()
+        while pos < len(buf):
+            ch = buf[pos]
+            if in_str:
+                if esc:
+                    esc = False
+                elif ch == "\\":
+                    esc = True
+                elif ch == '"':
+                    in_str = False
+            elif ch == '"':
+                in_str = True
+            elif ch == "{":
+                if depth == 0:
+                    start = pos
+                depth += 1
+            elif ch == "}" and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    try:
+                        yield json.loads(buf[start : pos + 1])
+                    except ValueError:
+                        pass
+                    start = -1
+            elif ch == "]" and depth == 0:
+                return
+            pos += 1
+        # Drop what has been consumed; keep an unfinished object.
+        cut = start if depth > 0 else pos
+        buf = buf[cut:]
+        pos -= cut
+        if start >= 0:
+            start = 0
+
+
+def _normalize_detected_item(it: Any) -> Optional[Dict[str, Any]]:
+    if not isinstance(it, dict):
+        return None
+    category = it.get("category")
+    if not isinstance(category, str) or not category.strip():
+        return None
+    sub = it.get("subCategory")
+    color = it.get("color")
+
+    sleeve = it.get("sleeveLength")
+    hem = it.get("hemLength")
+    scene = it.get("scene")
+    season = it.get("season")
+
+    # enforce canonical tags to reduce mismatch (prompt already should do this)
+    cat_norm = _norm_category(category)
+    col_norm = _norm_color(color) if isinstance(color, str) else None
+
+    out: Dict[str, Any] = {"category": cat_norm or category.strip()}
+    if isinstance(sub, str) and sub.strip():
+        out["subCategory"] = _norm_tag("subCategory", sub) or sub.strip()
+    if isinstance(color, str) and color.strip():
+        out["color"] = col_norm or color.strip().lower()
+
+    if isinstance(sleeve, str) and sleeve.strip():
+        out["sleeveLength"] = _norm_tag("sleeveLength", sleeve) or sleeve.strip()
+    if isinstance(hem, str) and hem.strip():
+        out["hemLength"] = _norm_tag("hemLength", hem) or hem.strip()
+    if isinstance(scene, str) and scene.strip():
+        out["scene"] = _norm_tag("scene", scene) or scene.strip()
+    if isinstance(season, list):
+        cleaned = [
+            _norm_tag("season", x) or str(x).strip()
+            for x in season
+            if str(x).strip()
+        ]
+        cleaned = [x for x in cleaned if x]
+        if cleaned:
+            out["season"] = cleaned
+    return out
+
 
-    primary_model = (os.environ.get("GEMINI_MODEL") or "gemini-1.5-flash-latest").strip()
+def _record_gemini_latency(seconds: float) -> None:
+    with _GEMINI_LATENCY_LOCK:
+        _GEMINI_LATENCIES.append(seconds)
+
+
+def _gemini_hedge_delay_s() -> float:
+    with _GEMINI_LATENCY_LOCK:
+        samples = sorted(_GEMINI_LATENCIES)
+    if len(samples) < _GEMINI_HEDGE_MIN_SAMPLES:
+        return _GEMINI_HEDGE_DELAY_MS / 1000.0
+    return samples[min(len(samples) - 1, int(len(samples) * _GEMINI_HEDGE_PERCENTILE / 100.0))]
+
+
+def _call_hedged(primary: Callable[[], Any], hedge: Callable[[], Any], delay_s: float) -> Any:
+    """Run `primary`; if it is still running after `delay_s`, also run `hedge`.
+
+    Returns the first successful result (the loser finishes in the background,
+    bounded by its own timeout). Only one request is paid for unless the first
+    is already in the slow tail. The latency the caller saw feeds the window
+    the next hedge delay is taken from.
+    """
+
+    started = time.perf_counter()
+    first = _GEMINI_HEDGE_EXECUTOR.submit(contextvars.copy_context().run, primary)
+    done, _ = wait([first], timeout=delay_s)
+    try:
+        _time_left("gemini hedge")
+    except _DeadlineExceeded:
+        done = {first}
+    if done:
+        result = first.result()
+        _record_gemini_latency(time.perf_counter() - started)
+        return result
+
+    _trace_count("geminiHedges")
+    second = _GEMINI_HEDGE_EXECUTOR.submit(contextvars.copy_context().run, hedge)
+    errors: List[BaseException] = []
+    for future in as_completed([first, second]):
+        try:
+            result = future.result()
+        except Exception as e:
+            errors.append(e)
+            continue
+        if future is second:
+            _trace_count("geminiHedgeWins")
+        _record_gemini_latency(time.perf_counter() - started)
+        return result
+    raise errors[0]
+
+
+def _gemini_take_token() -> None:
+    """Wait for a token-bucket slot, or raise _GeminiUnavailable if it would outlast the deadline."""
+
+    if _GEMINI_RATE_PER_SEC <= 0:
+        return
+    while True:
+        with _GEMINI_GUARD_LOCK:
+            now = time.monotonic()
+            bucket = _GEMINI_BUCKET
+            bucket["tokens"] = min(
+                _GEMINI_RATE_BURST, bucket["tokens"] + (now - bucket["updatedAt"]) * _GEMINI_RATE_PER_SEC
+            )
+            bucket["updatedAt"] = now
+            if bucket["tokens"] >= 1:
+                bucket["tokens"] -= 1
+                return
+            wait_s = (1 - bucket["tokens"]) / _GEMINI_RATE_PER_SEC
+        left = _time_left("gemini rate limit")
+        if left is not None and wait_s > left:
+            _trace_count("geminiRateLimited")
+            raise _GeminiUnavailable("Gemini rate limit reached", wait_s)
+        with _trace_stage("geminiRateWait"):
+            time.sleep(wait_s)
+
+
+def _gemini_breaker_retry_after() -> Optional[float]:
+    """Seconds until the open breaker admits a probe, or None when calls may proceed."""
+
+    with _GEMINI_GUARD_LOCK:
+        if _GEMINI_BREAKER["state"] == "closed":
+            return None
+        remaining = _GEMINI_BREAKER["openedAt"] + _GEMINI_BREAKER_COOLDOWN_SECONDS - time.monotonic()
+    return remaining if remaining > 0 else None
+
+
+def _gemini_breaker_allow() -> None:
+    """Admit one call, or raise _GeminiUnavailable while the breaker is open.
+
+    After the cooldown the first caller becomes the half-open probe; others keep
+    being rejected until it reports back (or another cooldown passes).
+    """
+
+    with _GEMINI_GUARD_LOCK:
+        breaker = _GEMINI_BREAKER
+        if breaker["state"] == "closed":
+            return
+        now = time.monotonic()
+        remaining = breaker["openedAt"] + _GEMINI_BREAKER_COOLDOWN_SECONDS - now
+        if remaining <= 0:
+            breaker["state"] = "half_open"
+            breaker["openedAt"] = now
+            _trace_count("geminiBreakerProbes")
+            return
+        state = breaker["state"]
+    _trace_count("geminiBreakerRejects")
+    raise _GeminiUnavailable(f"Gemini circuit breaker is {state}", max(remaining, 1.0))
+
+
+def _gemini_breaker_record(healthy: Optional[bool]) -> None:
+    """Report a call outcome; None means inconclusive (e.g. the deadline ran out first)."""
+
+    with _GEMINI_GUARD_LOCK:
+        breaker = _GEMINI_BREAKER
+        if healthy is None:
+            if breaker["state"] == "half_open":
+                # Let the next caller probe right away.
+                breaker["state"] = "open"
+                breaker["openedAt"] = time.monotonic() - _GEMINI_BREAKER_COOLDOWN_SECONDS
+            return
+        if healthy:
+            if breaker["state"] != "closed":
+                print("Gemini circuit breaker closed")
+            breaker.update(state="closed", failures=0)
+            return
+        breaker["failures"] += 1
+        if breaker["state"] == "half_open" or breaker["failures"] >= _GEMINI_BREAKER_FAILURES:
+            if breaker["state"] != "open":
+                print("Gemini circuit breaker opened:", {"failures": breaker["failures"]})
+            breaker["state"] = "open"
+            breaker["openedAt"] = time.monotonic()
+
+
+def _gemini_retryable(e: BaseException) -> bool:
+    if isinstance(e, HTTPError):
+        return e.code in _GEMINI_RETRYABLE_HTTP_CODES
+    return isinstance(e, (URLError, TimeoutError))
+
+
+def _gemini_retry_delay_s(e: BaseException, attempt: int) -> float:
+    # Honour a server-sent Retry-After (seconds form); otherwise full jitter.
+    retry_after = getattr(e, "headers", None) and e.headers.get("Retry-After")
+    if retry_after and retry_after.strip().isdigit():
+        return min(float(retry_after), _GEMINI_RETRY_BACKOFF_MAX_SECONDS)
+    cap = min(_GEMINI_RETRY_BACKOFF_MAX_SECONDS, _GEMINI_RETRY_BACKOFF_BASE_SECONDS * (2**attempt))
+    return random.uniform(0, cap)
+
+
+def _gemini_call_guarded(call: Callable[[], str], *, can_retry: Callable[[], bool]) -> str:
+    """Run one logical Gemini call through the circuit breaker, retrying retryable errors.
+
+    Errors left after the last attempt are re-raised unchanged; `can_retry`
+    vetoes a retry (e.g. once streamed items have been handed out).
+    """
+
+    attempt = 1
+    while True:
+        _gemini_breaker_allow()
+        try:
+            text = call()
+        except (HTTPError, URLError, TimeoutError) as e:
+            retryable = _gemini_retryable(e)
+            _gemini_breaker_record(not retryable)
+            if not retryable or attempt >= _GEMINI_MAX_ATTEMPTS or not can_retry():
+                raise
+            delay = _gemini_retry_delay_s(e, attempt)
+            left = _time_left("gemini retry")
+            if left is not None and delay >= left:
+                raise
+            _trace_count("geminiRetries")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except _GeminiUnavailable:
+            _gemini_breaker_record(None)
+            raise
+        except RuntimeError as e:
+            # Gemini answered (e.g. without text); only a spent deadline says nothing.
+            _gemini_breaker_record(None if isinstance(e, _DeadlineExceeded) else True)
+            raise
+        except BaseException:
+            _gemini_breaker_record(None)
+            raise
+        _gemini_breaker_record(True)
+        return text
+
+
+def _gemini_detect_items(
+    image_bytes: bytes,
+    mime_type: str = "image/jpeg",
+    on_item: Optional[Callable[[Dict[str, Any]], None]] = None,
+    on_incomplete: Optional[Callable[[str], None]] = None,
+) -> List[Dict[str, Any]]:
+    """Detect garments in one image.
+
+    `on_item` is called once per returned item, in order: as each item streams
+    in when GEMINI_STREAM=1, otherwise after the full response is parsed.
+    `on_incomplete` is called with a reason when the result is a best effort
+    (items salvaged from broken output, or a fallback), so it is not cached.
+    """
+
+    api_key = _get_gemini_api_key()
 
     prompt = _GEMINI_MASTER_PROMPT
 
+    _trace_bytes("uploadBytes", len(image_bytes))
+
     body = {
         "contents": [
             {
                 "parts": [
                     {
                         "inline_data": {
-                            "mime_type": "image/jpeg",
-                            "data": base64.b64encode(image_bytes).decode("ascii"),
+                            "mime_type": mime_type,
+                            "data": _GEMINI_IMAGE_PLACEHOLDER,
                         }
                     },
                     {"text": prompt},
@@ -238,182 +1716,296 @@ def _gemini_detect_items(image_bytes: bytes) -> List[Dict[str, Any]]:
             }
         ]
     }
+    if _GEMINI_GENERATION_CONFIG:
+        body["generationConfig"] = _GEMINI_GENERATION_CONFIG
 
-    def _gemini_generate_content(*, model_name: str) -> str:
-        url = (
-            f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent"
-            f"?key={api_key}"
-        )
-        data = json.dumps(body).encode("utf-8")
-        req = urllib_request.Request(
-            url,
-            data=data,
-            headers={"Content-Type": "application/json"},
-            method="POST",
-        )
-        with urllib_request.urlopen(req, timeout=25) as resp:
-            return resp.read().decode("utf-8")
-
-    def _gemini_list_models() -> List[Dict[str, Any]]:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}"
-        req = urllib_request.Request(url, headers={"Content-Type": "application/json"}, method="GET")
-        with urllib_request.urlopen(req, timeout=20) as resp:
-            raw = resp.read().decode("utf-8")
-        decoded = json.loads(raw)
-        models = decoded.get("models")
-        if isinstance(models, list):
-            return [m for m in models if isinstance(m, dict)]
-        return []
+    # Neither the base64 text nor the JSON document is built whole: the image
+    # is encoded slice by slice between the JSON around it while it is sent.
+    head, tail = (part.encode("utf-8") for part in json.dumps(body).split(_GEMINI_IMAGE_PLACEHOLDER))
+    content_length = len(head) + 4 * ((len(image_bytes) + 2) // 3) + len(tail)
 
-    def _supports_generate_content(model_obj: Dict[str, Any]) -> bool:
-        methods = model_obj.get("supportedGenerationMethods")
-        if not isinstance(methods, list):
-            return False
-        return any(isinstance(m, str) and m == "generateContent" for m in methods)
+    def _body_chunks() -> Iterator[bytes]:
+        yield head
+        view = memoryview(image_bytes)
+        for start in range(0, len(view), _GEMINI_BODY_CHUNK_BYTES):
+            yield base64.b64encode(view[start : start + _GEMINI_BODY_CHUNK_BYTES])
+        yield tail
 
-    def _pick_fallback_model(models: List[Dict[str, Any]]) -> Optional[str]:
-        names = []
-        for m in models:
-            if not _supports_generate_content(m):
-                continue
-            name = m.get("name")
-            if isinstance(name, str) and name.startswith("models/"):
-                names.append(name.replace("models/", "", 1))
-            elif isinstance(name, str):
-                names.append(name)
+    emitted: List[Dict[str, Any]] = []
 
-        if not names:
-            return None
+    def _gemini_generate_content(*, model_name: str) -> str:
+        """Return the model's output text (streamed items are emitted on the way)."""
 
-        prefer = [
-            "gemini-2.0-flash",
-            "gemini-2.0-flash-lite",
-            "gemini-1.5-flash-latest",
-            "gemini-1.5-flash",
-            "gemini-1.5-pro-latest",
-            "gemini-1.5-pro",
-            "gemini-pro",
-        ]
-        for p in prefer:
-            if p in names:
-                return p
+        if _GEMINI_STREAM:
+            url = f"{_GEMINI_API_BASE_URL}/v1beta/models/{model_name}:streamGenerateContent?alt=sse&key={api_key}"
+        else:
+            url = f"{_GEMINI_API_BASE_URL}/v1beta/models/{model_name}:generateContent?key={api_key}"
+        _gemini_take_token()
+        _trace_count("geminiCalls")
+        _trace_bytes("geminiRequestBytes", content_length)
+        started = time.perf_counter()
+        timeout = _time_left("gemini", _GEMINI_TIMEOUT.get())
+        headers = {"Content-Type": "application/json", "Content-Length": str(content_length)}
+        try:
+            with _trace_stage("gemini"), _http_open(
+                url, method="POST", body=_body_chunks, headers=headers, timeout=timeout
+            ) as resp:
+                if not _GEMINI_STREAM:
+                    raw = resp.read().decode("utf-8")
+                else:
+                    texts: List[str] = []
+                    fragments = _iter_gemini_sse_text(resp, texts)
+                    for obj in _iter_streamed_items(fragments):
+                        item = _normalize_detected_item(obj)
+                        if item is None:
+                            continue
+                        if not emitted:
+                            _trace_ms("geminiFirstItem", (time.perf_counter() - started) * 1000.0)
+                        emitted.append(item)
+                        if on_item is not None:
+                            on_item(item)
+                    for _ in fragments:
+                        pass
+                    text = "".join(texts)
+                    _trace_bytes("geminiResponseBytes", len(text.encode("utf-8")))
+                    return text
+        except (HTTPError, URLError, TimeoutError):
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            # The connection failed mid-body (IncompleteRead, reset): a network
+            # error like a failed send, so it is retried and counts for the breaker.
+            raise URLError(e)
+        _trace_bytes("geminiResponseBytes", len(raw))
 
-        # Otherwise, just pick the first available generateContent-capable model.
-        return names[0]
+        decoded = json.loads(raw)
+        usage = decoded.get("usageMetadata") or {}
+        if isinstance(usage.get("candidatesTokenCount"), int):
+            _trace_count("geminiOutputTokens", usage["candidatesTokenCount"])
+        text = ""
+        try:
+            candidates = decoded.get("candidates") or []
+            parts = (((candidates[0] or {}).get("content") or {}).get("parts") or [])
+            for p in parts:
+                if isinstance(p, dict) and isinstance(p.get("text"), str):
+                    text += p["text"]
+        except Exception:
+            text = ""
+        if not (text or "").strip():
+            raise RuntimeError(f"Gemini returned no text: {raw}")
+        return text
+
+    def _gemini_generate_content_hedged(*, model_name: str) -> str:
+        if not _GEMINI_HEDGE_ENABLED or _GEMINI_STREAM:
+            return _gemini_generate_content(model_name=model_name)
+        hedge_model = _GEMINI_HEDGE_MODEL or model_name
+        return _call_hedged(
+            lambda: _gemini_generate_content(model_name=model_name),
+            lambda: _gemini_generate_content(model_name=hedge_model),
+            _gemini_hedge_delay_s(),
+        )
 
+    # A retry after streamed items were handed out would hand them out twice.
+    def _can_retry() -> bool:
+        return not emitted
+
+    model_name = _gemini_active_model()
     try:
-        raw = _gemini_generate_content(model_name=primary_model)
-    except HTTPError as e:
-        raw_err = e.read().decode("utf-8") if hasattr(e, "read") else str(e)
-        if e.code == 404:
+        try:
+            text = _gemini_call_guarded(
+                lambda: _gemini_generate_content_hedged(model_name=model_name), can_retry=_can_retry
+            )
+        except HTTPError as e:
+            if e.code != 404:
+                raise
+            raw_err = e.read().decode("utf-8") if hasattr(e, "read") else str(e)
             try:
-                models = _gemini_list_models()
-                fallback = _pick_fallback_model(models)
-                if fallback:
-                    raw = _gemini_generate_content(model_name=fallback)
-                else:
-                    available = []
-                    for m in models[:25]:
-                        n = m.get("name")
-                        if isinstance(n, str):
-                            available.append(n)
-                    raise RuntimeError(
-                        "Gemini model not found and no generateContent-capable models available. "
-                        f"Set GEMINI_MODEL to a valid model. Available (sample): {available}"
-                    )
+                model_name = _gemini_rediscover_model(api_key, failed_model=model_name)
             except Exception as inner:
                 raise RuntimeError(f"Gemini HTTP 404: {raw_err}\n{type(inner).__name__}: {inner}")
+            text = _gemini_call_guarded(
+                lambda: _gemini_generate_content(model_name=model_name), can_retry=_can_retry
+            )
+    except HTTPError as e:
+        raw_err = e.read().decode("utf-8") if hasattr(e, "read") else str(e)
+        if e.code in _GEMINI_RETRYABLE_HTTP_CODES:
+            raise _GeminiUnavailable(f"Gemini HTTP {e.code}: {raw_err}", _GEMINI_RETRY_BACKOFF_MAX_SECONDS)
         raise RuntimeError(f"Gemini HTTP {e.code}: {raw_err}")
     except URLError as e:
-        raise RuntimeError(f"Gemini request failed: {e}")
-
-    decoded = json.loads(raw)
-    text = ""
-    try:
-        candidates = decoded.get("candidates") or []
-        parts = (((candidates[0] or {}).get("content") or {}).get("parts") or [])
-        for p in parts:
-            if isinstance(p, dict) and isinstance(p.get("text"), str):
-                text += p["text"]
-    except Exception:
-        text = ""
+        raise _GeminiUnavailable(f"Gemini request failed: {e}", _GEMINI_RETRY_BACKOFF_MAX_SECONDS)
+    except TimeoutError as e:
+        _time_left("gemini")  # a spent budget surfaces as _DeadlineExceeded
+        raise _GeminiUnavailable(f"Gemini request timed out: {e}", _GEMINI_RETRY_BACKOFF_MAX_SECONDS)
 
     text = (text or "").strip()
     if not text:
-        raise RuntimeError(f"Gemini returned no text: {raw}")
+        raise RuntimeError("Gemini returned no text")
+
+    # Structured output is plain JSON; anything else (output cut off at
+    # maxOutputTokens, prose or code fences around it) keeps its complete items.
+    def _incomplete(reason: str) -> None:
+        _trace_count("geminiIncomplete")
+        if on_incomplete is not None:
+            on_incomplete(reason)
 
-    # Try strict JSON parse
     try:
         parsed = json.loads(text)
-    except Exception:
-        # Fallback: extract first JSON object-like substring
-        start = text.find("{")
-        end = text.rfind("}")
-        if start >= 0 and end > start:
-            parsed = json.loads(text[start : end + 1])
+    except ValueError:
+        salvaged = list(_iter_streamed_items(iter([text])))
+        if salvaged:
+            print("Gemini output was not valid JSON; kept complete items:", len(salvaged))
+            _incomplete("salvaged")
+            parsed = {"detected_items": salvaged}
+        elif emitted:
+            _incomplete("emitted")
+            return list(emitted)
         else:
             raise RuntimeError(f"Gemini output is not JSON: {text[:400]}")
 
     if not isinstance(parsed, dict):
-        return []
+        _incomplete("not_object")
+        return list(emitted)
 
     items = parsed.get("detected_items")
     if not isinstance(items, list):
         # backward compatibility for older prompt/schema
         items = parsed.get("items")
     if not isinstance(items, list):
-        return []
-
-    normalized: List[Dict[str, Any]] = []
-    for it in items:
-        if not isinstance(it, dict):
-            continue
-        category = it.get("category")
-        if not isinstance(category, str) or not category.strip():
-            continue
-        sub = it.get("subCategory")
-        color = it.get("color")
-
-        sleeve = it.get("sleeveLength")
-        hem = it.get("hemLength")
-        scene = it.get("scene")
-        season = it.get("season")
-
-        # enforce canonical tags to reduce mismatch (prompt already should do this)
-        cat_norm = _norm_category(category)
-        col_norm = _norm_color(color) if isinstance(color, str) else None
-
-        out: Dict[str, Any] = {"category": cat_norm or category.strip()}
-        if isinstance(sub, str) and sub.strip():
-            out["subCategory"] = sub.strip()
-        if isinstance(color, str) and color.strip():
-            out["color"] = col_norm or color.strip().lower()
-
-        if isinstance(sleeve, str) and sleeve.strip():
-            out["sleeveLength"] = _norm_text(sleeve) or sleeve.strip()
-        if isinstance(hem, str) and hem.strip():
-            out["hemLength"] = _norm_text(hem) or hem.strip()
-        if isinstance(scene, str) and scene.strip():
-            out["scene"] = _norm_text(scene) or scene.strip()
-        if isinstance(season, list):
-            cleaned = [
-                _norm_text(x) or str(x).strip()
-                for x in season
-                if str(x).strip()
-            ]
-            cleaned = [x for x in cleaned if x]
-            if cleaned:
-                out["season"] = cleaned
-
-        normalized.append(out)
+        _incomplete("no_items")
+        return list(emitted)
+
+    normalized = [n for n in (_normalize_detected_item(it) for it in items) if n is not None]
+    # Streamed items were already handed out; the full parse only adds what the
+    # incremental parser could not see (e.g. output wrapped in prose).
+    if on_item is not None:
+        for item in normalized[len(emitted) :]:
+            on_item(item)
     return normalized
 
 
+def _detection_cache_key(image_bytes: bytes) -> str:
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    return f"{_gemini_model_name()}#{_GEMINI_PROMPT_VERSION}#{digest}"
+
+
+def _get_detection_cache_table():
+    table_name = (os.environ.get("DETECTION_CACHE_TABLE_NAME") or "").strip()
+    if not table_name:
+        return None
+    return _get_dynamodb_table(table_name)
+
+
+def _detection_cache_get(key: str) -> Optional[List[Dict[str, Any]]]:
+    with _DETECTION_CACHE_LOCK:
+        hit = _DETECTION_CACHE.get(key)
+        if hit is not None:
+            _DETECTION_CACHE.move_to_end(key)
+            print("Detection cache hit", {"tier": "memory"})
+            return copy.deepcopy(hit)
+
+    table = _get_detection_cache_table()
+    if table is None:
+        return None
+    try:
+        resp = table.get_item(Key={"cacheKey": key})
+    except ClientError as e:
+        # The cache must never fail the request; fall through to Gemini.
+        print("Detection cache read failed:", str(e))
+        return None
+
+    item = resp.get("Item")
+    # DynamoDB TTL deletion is lazy, so check expiry ourselves as well.
+    if not item or int(item.get("expiresAt") or 0) <= _now_epoch_seconds():
+        return None
+    try:
+        detected = json.loads(item.get("detectedItems") or "[]")
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(detected, list):
+        return None
+
+    _detection_cache_put_memory(key, detected)
+    print("Detection cache hit", {"tier": "dynamodb"})
+    return copy.deepcopy(detected)
+
+
+def _detection_cache_put_memory(key: str, detected: List[Dict[str, Any]]) -> None:
+    with _DETECTION_CACHE_LOCK:
+        _DETECTION_CACHE[key] = copy.deepcopy(detected)
+        _DETECTION_CACHE.move_to_end(key)
+        while len(_DETECTION_CACHE) > _DETECTION_CACHE_MAX_ENTRIES:
+            _DETECTION_CACHE.popitem(last=False)
+
+
+def _detection_cache_put(key: str, detected: List[Dict[str, Any]]) -> None:
+    _detection_cache_put_memory(key, detected)
+
+    table = _get_detection_cache_table()
+    if table is None:
+        return
+    try:
+        table.put_item(
+            Item={
+                "cacheKey": key,
+                # Stored as a JSON string: keeps list order and avoids Decimal round-trips.
+                "detectedItems": _json_dumps(detected),
+                "model": _gemini_model_name(),
+                "promptVersion": _GEMINI_PROMPT_VERSION,
+                "createdAt": _now_epoch_seconds(),
+                "expiresAt": _now_epoch_seconds() + _DETECTION_CACHE_TTL_SECONDS,
+            }
+        )
+    except ClientError as e:
+        print("Detection cache write failed:", str(e))
+
+
+def _detect_items_cached(
+    image_bytes: bytes,
+    on_item: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """`_gemini_detect_items` behind a content-addressed cache (retries/re-submits are free).
+
+    `on_item` follows the `_gemini_detect_items` contract on cache hits too.
+    Hits are served while the breaker is open; misses raise _GeminiUnavailable.
+    """
+
+    key = _detection_cache_key(image_bytes)
+    cached = _detection_cache_get(key)
+    if cached is not None:
+        if on_item is not None:
+            for item in cached:
+                on_item(item)
+        return cached
+    # Fail fast on a miss: no point preprocessing while the breaker is open.
+    retry_after = _gemini_breaker_retry_after()
+    if retry_after is not None:
+        _trace_count("geminiBreakerRejects")
+        raise _GeminiUnavailable("Gemini circuit breaker is open", retry_after)
+    with _trace_stage("preprocess"):
+        upload_bytes, mime_type = _preprocess_image(image_bytes)
+    incomplete: List[str] = []
+    detected = _gemini_detect_items(
+        upload_bytes, mime_type=mime_type, on_item=on_item, on_incomplete=incomplete.append
+    )
+    # A truncated or malformed answer would otherwise be served for the whole TTL.
+    if incomplete:
+        print("Detection not cached:", incomplete[0])
+    else:
+        _detection_cache_put(key, detected)
+    return detected
+
+
+_JST = timezone(timedelta(hours=9))
+
+
+def _now_jst() -> datetime:
+    # The app's calendar (seasons, months) is Japanese; Lambda runs in UTC.
+    return datetime.now(_JST)
+
+
 def _current_season_jst() -> str:
     # Simple month-based season for Japan.
     # spring: Mar-May, summer: Jun-Aug, fall: Sep-Nov, winter: Dec-Feb
-    jst = timezone(timedelta(hours=9))
-    m = datetime.now(jst).month
+    m = _now_jst().month
     if 3 <= m <= 5:
         return "spring"
     if 6 <= m <= 8:
@@ -423,183 +2015,512 @@ def _current_season_jst() -> str:
     return "winter"
 
 
-def _coerce_season_list(value: Any) -> List[str]:
-    if value is None:
-        return []
-    if isinstance(value, (set, tuple, list)):
-        out = []
-        for x in value:
-            v = _norm_text(x) or str(x).strip()
-            if v:
-                out.append(v)
-        return out
-    v = _norm_text(value) or str(value).strip()
-    return [v] if v else []
+def _coerce_season_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, (set, tuple, list)):
+        out = []
+        for x in value:
+            v = _norm_tag("season", x) or str(x).strip()
+            if v:
+                out.append(v)
+        return out
+    v = _norm_tag("season", value) or str(value).strip()
+    return [v] if v else []
+
+
+def _season_mask(value: Any) -> int:
+    mask = 0
+    for v in _coerce_season_list(value):
+        mask |= _SEASON_BITS.get(v, 0)
+    return mask
+
+
+def _score_positions(
+    snap: Dict[str, Any],
+    detected: Dict[str, Any],
+    positions: List[int],
+    season_bit: int,
+) -> List[Tuple[int, int]]:
+    """Score candidate positions against one detected item; returns (score, position) pairs."""
+
+    vocab = snap["vocab"]
+    columns = snap["columns"]
+    # -1 never equals an encoded tag, so a missing/unknown detected tag scores nothing.
+    terms = []
+    for field in _MATCH_TAG_FIELDS:
+        weight = _MATCH_WEIGHTS.get(field, 0)
+        code = vocab.get(_norm_tag(field, detected.get(field)) or "", -1)
+        if weight and code > 0:
+            terms.append((columns[field], code, weight))
+    season_weight = _MATCH_WEIGHTS.get("season", 0)
+    season_mask = snap["seasonMask"]
+
+    scored = []
+    for pos in positions:
+        score = season_weight if season_mask[pos] & season_bit else 0
+        for column, code, weight in terms:
+            if column[pos] == code:
+                score += weight
+        scored.append((score, pos))
+    return scored
+
+
+def _candidate_view(item: Dict[str, Any], score: int) -> Dict[str, Any]:
+    return {
+        "clothesId": item.get("clothesId"),
+        "category": item.get("category"),
+        "subCategory": item.get("subCategory"),
+        "color": item.get("color"),
+        "sleeveLength": item.get("sleeveLength"),
+        "hemLength": item.get("hemLength"),
+        "season": item.get("season"),
+        "scene": item.get("scene"),
+        "imageUrl": item.get("imageUrl"),
+        "score": score,
+    }
+
+
+def _match_detected(
+    snap: Dict[str, Any],
+    detected: Dict[str, Any],
+    *,
+    top_k: int,
+    season_bit: int,
+) -> Dict[str, Any]:
+    category = detected.get("category")
+    color = detected.get("color")
+    positions = _snapshot_candidates(snap, category, color)
+
+    print(
+        "Analyze match",
+        {
+            "detected": detected,
+            "categoryColor": _category_color(category, color),
+            "categoryColorNorm": _category_color_norm(category, color),
+            "candidatesCount": len(positions),
+        },
+    )
+
+    _trace_count("candidates", len(positions))
+    with _trace_stage("score"):
+        scored = _score_positions(snap, detected, positions, season_bit)
+        # Partial selection; nlargest is stable like the former full sort, so ties keep closet order.
+        top = heapq.nlargest(top_k, scored, key=lambda t: t[0])
+    best_score = top[0][0] if top else 0
+
+    items = snap["items"]
+    return {
+        "detected": detected,
+        "candidates": [_candidate_view(items[pos], score) for score, pos in top],
+        "bestScore": best_score,
+        "needsRegister": best_score <= _NO_MATCH_THRESHOLD,
+    }
+
+
+def _recent_wear_counts(user_id: str) -> Dict[str, int]:
+    """Wears per clothesId in the current and previous month, from the monthly stats items."""
+
+    this_month = _now_jst().replace(day=1)
+    months = [this_month.strftime("%Y-%m"), (this_month - timedelta(days=1)).strftime("%Y-%m")]
+    keys = [{"userId": user_id, "logId": _wear_stats_log_id(m)} for m in months]
+    counts: Dict[str, int] = {}
+    for item in _batch_get(_get_wearlog_table().name, keys):
+        for k, v in item.items():
+            if k.startswith("c:"):
+                counts[k[2:]] = counts.get(k[2:], 0) + int(v)
+    return counts
+
+
+def _degraded_results(
+    user_id: str,
+    snap: Dict[str, Any],
+    *,
+    top_k: int,
+    season_bit: int,
+) -> List[Dict[str, Any]]:
+    """Gemini-free suggestions: per category, in-season and recently worn garments first.
+
+    Shaped like `_match_detected` results (the detected item is just the
+    category) and flagged `degraded` so clients can say so.
+    """
+
+    try:
+        wear = _recent_wear_counts(user_id)
+    except (ClientError, BotoCoreError) as e:
+        print("Degraded analyze without wear stats:", str(e))
+        wear = {}
+
+    items = snap["items"]
+    season_mask = snap["seasonMask"]
+    season_weight = _MATCH_WEIGHTS.get("season", 0)
+    results = []
+    for category in _MASTER_TAGS["category"]:
+        positions = snap["byNormCategory"].get(category)
+        if not positions:
+            continue
+        scored = [
+            (
+                (season_weight if season_mask[pos] & season_bit else 0)
+                + _DEGRADED_WEAR_WEIGHT * wear.get(str(items[pos].get("clothesId")), 0),
+                pos,
+            )
+            for pos in positions
+        ]
+        top = heapq.nlargest(top_k, scored, key=lambda t: t[0])
+        results.append(
+            {
+                "detected": {"category": category},
+                "candidates": [_candidate_view(items[pos], score) for score, pos in top],
+                "bestScore": top[0][0],
+                "needsRegister": False,
+                "degraded": True,
+            }
+        )
+    return results
+
+
+def _timed_stage(stages: Dict[str, Tuple[float, float]], name: str, fn: Callable[..., Any], *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        stages[name] = (start, time.perf_counter())
+
+
+def _stage_timings_ms(stages: Dict[str, Tuple[float, float]], origin: float) -> Dict[str, Any]:
+    """Per-stage durations plus how much of the closet read was hidden behind download+detect."""
+
+    out: Dict[str, Any] = {
+        name: round((end - start) * 1000, 1) for name, (start, end) in stages.items()
+    }
+    if "closet" in stages and "detect" in stages:
+        serial = sum(stages[n][1] - stages[n][0] for n in ("download", "detect", "closet") if n in stages)
+        ready = max(stages["detect"][1], stages["closet"][1]) - origin
+        out["overlapSavedMs"] = round(max(serial - ready, 0.0) * 1000, 1)
+    out["totalMs"] = round((time.perf_counter() - origin) * 1000, 1)
+    return out
+
+
+def _parse_top_k(value: Any) -> int:
+    if not isinstance(value, int) or value <= 0 or value > 10:
+        return 3
+    return value
+
+
+def _parse_selfie_ref(value: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    selfie_url = value.get("selfieUrl")
+    selfie_key = value.get("selfieKey")
+    selfie_url = selfie_url if isinstance(selfie_url, str) else None
+    selfie_key = selfie_key if isinstance(selfie_key, str) else None
+    if not (selfie_url and selfie_url.strip()) and not (selfie_key and selfie_key.strip()):
+        raise ValueError("selfieUrl or selfieKey is required")
+    return selfie_url, selfie_key
+
+
+def _handle_analyze(event, user_id: str):
+    payload = _parse_json_body(event)
+    top_k = _parse_top_k(payload.get("topK"))
+    selfie_url, selfie_key = _parse_selfie_ref(payload)
+
+    q = event.get("queryStringParameters") or {}
+    if (q.get("async") or "").lower() in ("1", "true"):
+        return _submit_analyze_job(user_id, selfie_url=selfie_url, selfie_key=selfie_key, top_k=top_k)
+
+    try:
+        results = _analyze_selfie(user_id, selfie_url=selfie_url, selfie_key=selfie_key, top_k=top_k)
+    except ClientError as e:
+        return _response(500, {"ok": False, "error": str(e)})
+    body: Dict[str, Any] = {"ok": True, "results": results}
+    if any(r.get("degraded") for r in results):
+        body["degraded"] = True
+    return _response(200, body)
+
+
+def _analyze_selfie(
+    user_id: str,
+    *,
+    selfie_url: Optional[str],
+    selfie_key: Optional[str],
+    top_k: int,
+    on_result: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """Download, detect and match one selfie (shared by sync /analyze and the job worker).
+
+    Each detected item is matched as soon as detection hands it over; with
+    GEMINI_STREAM=1 that is while Gemini is still generating the rest.
+    `on_result` receives the results so far after every match.
+
+    While Gemini is unavailable (breaker open, retries exhausted) the results
+    come from `_degraded_results` if ANALYZE_DEGRADED_MODE allows it.
+    """
+
+    origin = time.perf_counter()
+    stages: Dict[str, Tuple[float, float]] = {}
+
+    # The closet read does not depend on Gemini output: start it now so it runs
+    # while the image is fetched and the model is thinking.
+    closet_future = _submit_traced(_timed_stage, stages, "closet", _load_closet_snapshot, user_id)
+    season_bit = _SEASON_BITS[_current_season_jst()]
+    results: List[Dict[str, Any]] = []
+
+    def _degrade(e: _GeminiUnavailable) -> List[Dict[str, Any]]:
+        if not _ANALYZE_DEGRADED_MODE or results:
+            raise e
+        print("Analyze degraded:", str(e))
+        _trace_count("analyzeDegraded")
+        degraded = _timed_stage(
+            stages, "degraded", _degraded_results, user_id, closet_future.result(), top_k=top_k, season_bit=season_bit
+        )
+        if on_result is not None:
+            on_result(list(degraded))
+        print("Analyze timings", _stage_timings_ms(stages, origin))
+        return degraded
+
+    # The image is fetched even while the breaker is open: its hash may still
+    # hit the detection cache, and only a miss degrades.
+    image_bytes = _timed_stage(
+        stages, "download", _download_image_bytes, selfie_url=selfie_url, selfie_key=selfie_key
+    )
+
+    def _match_now(detected: Dict[str, Any]) -> None:
+        # One closet read per request (or none while the warm snapshot is fresh),
+        # instead of up to three queries per detected item.
+        snapshot = closet_future.result()
+        match_start = time.perf_counter()
+        results.append(_match_detected(snapshot, detected, top_k=top_k, season_bit=season_bit))
+        first_start = stages["match"][0] if "match" in stages else match_start
+        stages["match"] = (first_start, time.perf_counter())
+        if on_result is not None:
+            on_result(list(results))
+
+    try:
+        detected_items = _timed_stage(stages, "detect", _detect_items_cached, image_bytes, on_item=_match_now)
+    except _GeminiUnavailable as e:
+        return _degrade(e)
+
+    print(
+        "Analyze detected_items=",
+        detected_items,
+    )
+
+    print("Analyze timings", _stage_timings_ms(stages, origin))
+    return results
+
+
+def _get_analyze_jobs_table():
+    table_name = (os.environ.get("ANALYZE_JOBS_TABLE_NAME") or "").strip()
+    if not table_name:
+        return None
+    return _get_dynamodb_table(table_name)
+
+
+def _save_analyze_job(job: Dict[str, Any]) -> None:
+    job["updatedAt"] = _now_epoch_seconds()
+    table = _get_analyze_jobs_table()
+    if table is None:
+        # Local/dev stand-in: jobs live in this process only.
+        with _LOCAL_ANALYZE_JOBS_LOCK:
+            _LOCAL_ANALYZE_JOBS[(job["userId"], job["jobId"])] = copy.deepcopy(job)
+        return
+    table.put_item(Item={k: v for k, v in job.items() if v is not None})
+
+
+def _load_analyze_job(user_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+    table = _get_analyze_jobs_table()
+    if table is None:
+        with _LOCAL_ANALYZE_JOBS_LOCK:
+            job = _LOCAL_ANALYZE_JOBS.get((user_id, job_id))
+        return copy.deepcopy(job) if job else None
+    return table.get_item(Key={"userId": user_id, "jobId": job_id}).get("Item")
+
+
+def _enqueue_analyze_job(user_id: str, job_id: str) -> None:
+    queue_url = (os.environ.get("ANALYZE_QUEUE_URL") or "").strip()
+    if not queue_url:
+        # In-process stand-in for local tests: run the worker on its own pool.
+        # (Not for deployed use: Lambda freezes background threads after returning.)
+        _LOCAL_ANALYZE_JOB_EXECUTOR.submit(_run_analyze_job, user_id, job_id)
+        return
+    _get_aws_client("sqs").send_message(
+        QueueUrl=queue_url,
+        MessageBody=_json_dumps({"userId": user_id, "jobId": job_id}),
+    )
 
 
-def _score_candidate(detected: Dict[str, Any], item: Dict[str, Any]) -> int:
-    """Weighted scoring for matching detected tags to closet items.
+def _submit_analyze_job(user_id: str, *, selfie_url: Optional[str], selfie_key: Optional[str], top_k: int):
+    now = _now_epoch_seconds()
+    job = {
+        "userId": user_id,
+        "jobId": str(uuid.uuid4()),
+        "status": "queued",
+        "selfieUrl": selfie_url,
+        "selfieKey": selfie_key,
+        "topK": top_k,
+        "createdAt": now,
+        "expiresAt": now + _ANALYZE_JOB_TTL_SECONDS,
+    }
+    try:
+        _save_analyze_job(job)
+        _enqueue_analyze_job(user_id, job["jobId"])
+    except ClientError as e:
+        return _response(500, {"ok": False, "error": str(e)})
+    return _response(202, {"ok": True, "jobId": job["jobId"], "status": "queued"})
 
-    Weights (additive):
-    - subCategory: +50 (exact)
-    - sleeveLength: +20 (exact)
-    - hemLength: +20 (exact)
-    - scene: +10 (exact)
-    - season: +10 (current season included in item's season)
-    """
 
-    score = 0
+def _run_analyze_job(user_id: str, job_id: str) -> None:
+    """Worker: run one queued job and store its outcome on the job item.
 
-    det_sub = _norm_text(detected.get("subCategory"))
-    det_sleeve = _norm_text(detected.get("sleeveLength"))
-    det_hem = _norm_text(detected.get("hemLength"))
-    det_scene = _norm_text(detected.get("scene"))
+    Analysis errors mark the job failed (clients see them when polling);
+    job-store errors propagate so the queue redelivers the message.
+    """
 
-    item_sub = _norm_text(item.get("subCategory"))
-    item_sleeve = _norm_text(item.get("sleeveLength"))
-    item_hem = _norm_text(item.get("hemLength"))
-    item_scene = _norm_text(item.get("scene"))
+    job = _load_analyze_job(user_id, job_id)
+    if not job:
+        print("Analyze job not found:", {"userId": user_id, "jobId": job_id})
+        return
+    if job.get("status") in ("succeeded", "failed"):
+        return
 
-    if det_sub and item_sub and det_sub == item_sub:
-        score += 50
+    job["status"] = "running"
+    _save_analyze_job(job)
 
-    if det_sleeve and item_sleeve and det_sleeve == item_sleeve:
-        score += 20
+    def _save_partial(results: List[Dict[str, Any]]) -> None:
+        # Pollers see the first suggestions while the rest is still streaming in.
+        job["resultsJson"] = _json_dumps(results)
+        _save_analyze_job(job)
 
-    if det_hem and item_hem and det_hem == item_hem:
-        score += 20
+    try:
+        results = _analyze_selfie(
+            user_id,
+            selfie_url=job.get("selfieUrl"),
+            selfie_key=job.get("selfieKey"),
+            top_k=_parse_top_k(int(job.get("topK") or 3)),
+            on_result=_save_partial if _GEMINI_STREAM else None,
+        )
+        job["status"] = "succeeded"
+        # Stored as a JSON string: avoids Decimal/set round-trips through DynamoDB.
+        job["resultsJson"] = _json_dumps(results)
+    except Exception as e:
+        print("Analyze job failed:", {"jobId": job_id, "error": f"{type(e).__name__}: {e}"})
+        job["status"] = "failed"
+        job["error"] = str(e)
+        job.pop("resultsJson", None)
+    _save_analyze_job(job)
 
-    if det_scene and item_scene and det_scene == item_scene:
-        score += 10
 
-    current = _current_season_jst()
-    item_seasons = _coerce_season_list(item.get("season"))
-    if current in item_seasons:
-        score += 10
+def _handle_analyze_queue(event) -> Dict[str, Any]:
+    """SQS event source entry point (partial batch failures are reported back)."""
 
-    return score
+    failures = []
+    for record in event.get("Records") or []:
+        try:
+            message = json.loads(record.get("body") or "{}")
+            _run_analyze_job(message["userId"], message["jobId"])
+        except Exception as e:
+            print("Analyze queue record failed:", f"{type(e).__name__}: {e}")
+            print(traceback.format_exc())
+            failures.append({"itemIdentifier": record.get("messageId")})
+    return {"batchItemFailures": failures}
 
 
-def _handle_analyze(event, user_id: str):
-    payload = _parse_json_body(event)
-    selfie_key = payload.get("selfieKey")
-    selfie_url = payload.get("selfieUrl")
-    top_k = payload.get("topK")
-    if not isinstance(top_k, int) or top_k <= 0 or top_k > 10:
-        top_k = 3
-
-    image_bytes = _download_image_bytes(
-        selfie_url=selfie_url if isinstance(selfie_url, str) else None,
-        selfie_key=selfie_key if isinstance(selfie_key, str) else None,
-    )
+def _handle_analyze_job_get(user_id: str, job_id: str):
+    try:
+        job = _load_analyze_job(user_id, job_id)
+    except ClientError as e:
+        return _response(500, {"ok": False, "error": str(e)})
+    if not job:
+        return _response(404, {"ok": False, "error": "Not found"})
 
-    detected_items = _gemini_detect_items(image_bytes)
-    table = _get_table()
-    gsi_name = os.environ.get("CLOTHES_GSI_NAME", "byCategoryAndColor")
+    out = {
+        "jobId": job.get("jobId"),
+        "status": job.get("status"),
+        "createdAt": job.get("createdAt"),
+        "updatedAt": job.get("updatedAt"),
+    }
+    if job.get("resultsJson"):
+        out["results"] = json.loads(job["resultsJson"])
+    if job.get("error"):
+        out["error"] = job["error"]
+    return _response(200, {"ok": True, "job": out})
 
-    print(
-        "Analyze detected_items=",
-        detected_items,
-    )
 
-    results: List[Dict[str, Any]] = []
-    no_match_threshold = 20
-    for detected in detected_items:
-        category = detected.get("category")
-        color = detected.get("color")
-        category_color = _category_color(category, color)
-        category_color_norm = _category_color_norm(category, color)
-
-        candidates: List[Dict[str, Any]] = []
-        try:
-            if category_color:
-                resp = table.query(
-                    IndexName=gsi_name,
-                    KeyConditionExpression=Key("userId").eq(user_id)
-                    & Key("categoryColor").eq(category_color),
-                )
-                candidates = resp.get("Items") or []
-
-            # If nothing matched, try normalized key (covers cases like "紺" vs "navy" if stored normalized)
-            if not candidates and category_color_norm and category_color_norm != category_color:
-                resp = table.query(
-                    IndexName=gsi_name,
-                    KeyConditionExpression=Key("userId").eq(user_id)
-                    & Key("categoryColor").eq(category_color_norm),
-                )
-                candidates = resp.get("Items") or []
-
-            # Final fallback: query all for user and filter by normalized category/color
-            if not candidates:
-                resp = table.query(KeyConditionExpression=Key("userId").eq(user_id))
-                all_items = resp.get("Items") or []
-                det_cat = _norm_category(category)
-                det_col = _norm_color(color)
-                filtered = []
-                for it in all_items:
-                    if det_cat and _norm_category(it.get("category")) != det_cat:
-                        continue
-                    if det_col and _norm_color(it.get("color")) != det_col:
-                        # allow category-only match if color mismatch
-                        continue
-                    filtered.append(it)
-
-                # If still empty and we had a color, relax to category-only.
-                if not filtered and det_cat:
-                    for it in all_items:
-                        if _norm_category(it.get("category")) == det_cat:
-                            filtered.append(it)
-
-                candidates = filtered
-        except ClientError as e:
-            return _response(500, {"ok": False, "error": str(e)})
+def _fetch_and_detect(selfie_url: Optional[str], selfie_key: Optional[str]) -> List[Dict[str, Any]]:
+    image_bytes = _download_image_bytes(selfie_url=selfie_url, selfie_key=selfie_key)
+    return _detect_items_cached(image_bytes)
 
-        print(
-            "Analyze match",
-            {
-                "detected": detected,
-                "categoryColor": category_color,
-                "categoryColorNorm": category_color_norm,
-                "candidatesCount": len(candidates),
-            },
-        )
 
-        scored = []
-        for c in candidates:
-            s = _score_candidate(detected, c)
-            scored.append((s, c))
-        scored.sort(key=lambda t: t[0], reverse=True)
+def _handle_analyze_batch(event, user_id: str):
+    """POST /analyze/batch: analyze many selfies with one shared closet load.
 
-        best_score = scored[0][0] if scored else 0
-        needs_register = best_score <= no_match_threshold
+    Body: {"selfies": [{"selfieKey": ...} | {"selfieUrl": ...}, ...]} or
+    {"selfieKeys": [...]}, plus optional topK. Images are fetched and detected
+    on the bounded analyze pool; each entry reports its own success or error.
+    """
 
-        top = []
-        for s, c in scored[:top_k]:
-            top.append(
-                {
-                    "clothesId": c.get("clothesId"),
-                    "category": c.get("category"),
-                    "subCategory": c.get("subCategory"),
-                    "color": c.get("color"),
-                    "sleeveLength": c.get("sleeveLength"),
-                    "hemLength": c.get("hemLength"),
-                    "season": c.get("season"),
-                    "scene": c.get("scene"),
-                    "imageUrl": c.get("imageUrl"),
-                    "score": s,
-                }
-            )
+    payload = _parse_json_body(event)
+    top_k = _parse_top_k(payload.get("topK"))
+
+    selfies = payload.get("selfies")
+    if selfies is None and isinstance(payload.get("selfieKeys"), list):
+        selfies = [{"selfieKey": k} for k in payload["selfieKeys"]]
+    if not isinstance(selfies, list) or not selfies:
+        raise ValueError("selfies (or selfieKeys) must be a non-empty array")
+    if len(selfies) > _ANALYZE_BATCH_MAX:
+        raise ValueError(f"At most {_ANALYZE_BATCH_MAX} selfies per batch")
+
+    origin = time.perf_counter()
+    closet_future = _submit_traced(_load_closet_snapshot, user_id)
+
+    entries: List[Dict[str, Any]] = []
+    futures = {}
+    for i, ref in enumerate(selfies):
+        entry: Dict[str, Any] = {"index": i}
+        entries.append(entry)
+        try:
+            if not isinstance(ref, dict):
+                raise ValueError("each selfie must be an object")
+            selfie_url, selfie_key = _parse_selfie_ref(ref)
+        except ValueError as e:
+            entry.update({"ok": False, "error": str(e)})
+            continue
+        if selfie_key:
+            entry["selfieKey"] = selfie_key
+        else:
+            entry["selfieUrl"] = selfie_url
+        futures[_submit_traced(_fetch_and_detect, selfie_url, selfie_key)] = entry
 
-        results.append(
-            {
-                "detected": detected,
-                "candidates": top,
-                "bestScore": best_score,
-                "needsRegister": needs_register,
-            }
-        )
+    try:
+        snapshot = closet_future.result()
+    except ClientError as e:
+        return _response(500, {"ok": False, "error": str(e)})
+
+    # Match each image as soon as its detection finishes.
+    season_bit = _SEASON_BITS[_current_season_jst()]
+    for future in as_completed(futures):
+        entry = futures[future]
+        try:
+            detected_items = future.result()
+        except (ValueError, RuntimeError) as e:
+            entry.update({"ok": False, "error": str(e)})
+            continue
+        except Exception as e:
+            # Anything else (e.g. BotoCoreError from S3) still fails only this image.
+            print("Analyze batch entry failed:", repr(e))
+            entry.update({"ok": False, "error": f"{type(e).__name__}: {e}"})
+            continue
+        entry["ok"] = True
+        entry["results"] = [
+            _match_detected(snapshot, detected, top_k=top_k, season_bit=season_bit)
+            for detected in detected_items
+        ]
 
-    return _response(200, {"ok": True, "results": results})
+    failed = sum(1 for e in entries if not e.get("ok"))
+    print(
+        "Analyze batch",
+        {"count": len(entries), "failed": failed, "totalMs": round((time.perf_counter() - origin) * 1000, 1)},
+    )
+    return _response(200, {"ok": True, "results": entries, "failedCount": failed})
 
 
 def _parse_iso_date(value: str) -> str:
@@ -628,18 +2549,67 @@ def _handle_logs_get(event, user_id: str):
     start = f"{from_s}#"
     end = f"{to_s}#\uffff"
 
+    limit = _parse_limit(q.get("limit"))
+    start_key = _decode_next_token(q.get("nextToken"), user_id)
+
+    expand = {e.strip() for e in (q.get("expand") or "").split(",") if e.strip()}
+    unknown = sorted(expand - {"clothes"})
+    if unknown:
+        raise ValueError(f"Unknown expand: {', '.join(unknown)}")
+
+    # The default range moves with the date, so tag the resolved range. Expanded
+    # clothes also change when the closet does.
+    collections = ("logs", "clothes") if expand else ("logs",)
+    etag = _collection_etag(user_id, {**q, "from": from_s, "to": to_s}, *collections)
+    if etag and _etag_matches(event, etag):
+        return _response(304, None, {"ETag": etag})
+
     table = _get_wearlog_table()
     try:
-        resp = table.query(
-            KeyConditionExpression=Key("userId").eq(user_id) & Key("logId").between(start, end)
+        # logId is "<date>#<uuid>", so descending key order is newest first.
+        # A tagged body must be read consistently: an eventually consistent
+        # read could pair the new version with the old items.
+        items, last_key = _query_page(
+            table,
+            limit=limit,
+            exclusive_start_key=start_key,
+            KeyConditionExpression=Key("userId").eq(user_id) & Key("logId").between(start, end),
+            ScanIndexForward=False,
+            ConsistentRead=etag is not None,
         )
+        if "clothes" in expand:
+            _expand_log_clothes(user_id, items, consistent_read=etag is not None)
     except ClientError as e:
         return _response(500, {"ok": False, "error": str(e)})
 
-    items = resp.get("Items") or []
-    # newest first
-    items.sort(key=lambda x: (x.get("date") or "", x.get("logId") or ""), reverse=True)
-    return _response(200, {"ok": True, "items": items})
+    return _response(
+        200,
+        {"ok": True, "items": items, "nextToken": _encode_next_token(last_key)},
+        {"ETag": etag} if etag else None,
+    )
+
+
+def _expand_log_clothes(user_id: str, logs: List[Dict[str, Any]], *, consistent_read: bool = False) -> None:
+    """Inline each log's garments as `clothes`, reading every id once per page.
+
+    Garments that were deleted (or could not be read) are left out; clients
+    can still fall back to GET /clothes/{id} for those.
+    """
+
+    clothes_ids = list(
+        dict.fromkeys(str(c) for log in logs for c in (log.get("clothesIds") or []) if str(c).strip())
+    )
+    by_id: Dict[str, Dict[str, Any]] = {}
+    if clothes_ids:
+        keys = [{"userId": user_id, "clothesId": c} for c in clothes_ids]
+        by_id = {
+            item["clothesId"]: item
+            for item in _batch_get(_get_table().name, keys, consistent_read=consistent_read)
+        }
+    for log in logs:
+        log["clothes"] = [
+            _public_clothes_item(by_id[str(c)]) for c in (log.get("clothesIds") or []) if str(c) in by_id
+        ]
 
 
 def _handle_logs_post(event, user_id: str):
@@ -673,13 +2643,94 @@ def _handle_logs_post(event, user_id: str):
 
     table = _get_wearlog_table()
     try:
-        table.put_item(Item=item, ConditionExpression="attribute_not_exists(logId)")
+        _write_with_version_bump(
+            table, user_id, "logs", "Put", Item=item, ConditionExpression="attribute_not_exists(logId)"
+        )
     except ClientError as e:
         return _response(500, {"ok": False, "error": str(e)})
 
+    try:
+        _add_wear_stats(table, user_id, date, clothes_ids or [])
+    except ClientError as e:
+        # The log itself is stored; only the monthly aggregate missed this write.
+        print("Wear stats update failed:", str(e))
+
     return _response(201, {"ok": True, "item": item})
 
 
+def _wear_stats_log_id(month: str) -> str:
+    # Lives next to the logs in the same partition; "stats#" sorts after every
+    # "<YYYY-MM-DD>#..." logId, so date-range log queries never return it.
+    return f"{_WEAR_STATS_PREFIX}{month}"
+
+
+def _add_wear_stats(table, user_id: str, date: str, clothes_ids: List[Any]) -> None:
+    """Atomically bump the per-user monthly counters for one new log.
+
+    Counters are top-level attributes (ADD only works on top-level attributes):
+    logCount, d:<YYYY-MM-DD> per day and c:<clothesId> per garment.
+    """
+
+    names = {"#n": "logCount", "#d": f"d:{date}"}
+    adds = ["#n :one", "#d :one"]
+    unique_ids = list(dict.fromkeys(str(c) for c in clothes_ids if str(c).strip()))
+    for i, clothes_id in enumerate(unique_ids):
+        names[f"#c{i}"] = f"c:{clothes_id}"
+        adds.append(f"#c{i} :one")
+
+    table.update_item(
+        Key={"userId": user_id, "logId": _wear_stats_log_id(date[:7])},
+        UpdateExpression="ADD " + ", ".join(adds),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues={":one": 1},
+    )
+
+
+def _handle_logs_stats(event, user_id: str):
+    q = event.get("queryStringParameters") or {}
+    month = q.get("month")
+    if not isinstance(month, str) or not month.strip():
+        month = _now_jst().strftime("%Y-%m")
+    month = month.strip()
+    try:
+        datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise ValueError("month must be YYYY-MM")
+
+    top_n = q.get("top")
+    try:
+        top_n = min(max(int(top_n), 1), 50) if top_n else 3
+    except ValueError:
+        raise ValueError("top must be an integer")
+
+    table = _get_wearlog_table()
+    try:
+        resp = table.get_item(Key={"userId": user_id, "logId": _wear_stats_log_id(month)})
+    except ClientError as e:
+        return _response(500, {"ok": False, "error": str(e)})
+
+    item = resp.get("Item") or {}
+    clothes_counts = []
+    days: Dict[str, int] = {}
+    for k, v in item.items():
+        if k.startswith("c:"):
+            clothes_counts.append((int(v), k[2:]))
+        elif k.startswith("d:"):
+            days[k[2:]] = int(v)
+    top = heapq.nlargest(top_n, clothes_counts, key=lambda t: t[0])
+
+    return _response(
+        200,
+        {
+            "ok": True,
+            "month": month,
+            "logCount": int(item.get("logCount") or 0),
+            "topClothes": [{"clothesId": clothes_id, "count": count} for count, clothes_id in top],
+            "days": dict(sorted(days.items())),
+        },
+    )
+
+
 def _get_clothes_id_from_event(event) -> Optional[str]:
     path_params = event.get("pathParameters") or {}
     proxy = path_params.get("proxy")
@@ -701,15 +2752,38 @@ def _category_color(category: Optional[str], color: Optional[str]) -> Optional[s
     return f"{category}#{color}"
 
 
+@functools.lru_cache(maxsize=4096)
+def _norm_text_str(value: str) -> Optional[str]:
+    v = value.strip().lower()
+    if not v:
+        return None
+    v = _WHITESPACE_RE.sub(" ", v)
+    return v
+
+
 def _norm_text(value: Optional[str]) -> Optional[str]:
     if value is None:
         return None
     if not isinstance(value, str):
         value = str(value)
-    v = value.strip().lower()
-    if not v:
-        return None
-    v = re.sub(r"\s+", " ", v)
+    return _norm_text_str(value)
+
+
+@functools.lru_cache(maxsize=1024)
+def _guess_category(v: str) -> str:
+    # heuristic contains (only for strings missing from the lookup table; memoized)
+    for canonical, needles in _CATEGORY_CONTAINS:
+        if any(n in v for n in needles):
+            return canonical
+    return v
+
+
+@functools.lru_cache(maxsize=1024)
+def _guess_color(v: str) -> str:
+    # normalize common variants (first match wins, e.g. "navy blue" -> navy)
+    for canonical, needles in _COLOR_CONTAINS:
+        if any(n in v for n in needles):
+            return canonical
     return v
 
 
@@ -717,56 +2791,49 @@ def _norm_category(value: Optional[str]) -> Optional[str]:
     v = _norm_text(value)
     if not v:
         return None
+    return _TAG_LOOKUP["category"].get(v) or _guess_category(v)
 
-    # canonical categories used in this app
-    if v in {"tops", "top", "トップス", "シャツ", "t-shirt", "tshirt", "tee", "shirt", "blouse"}:
-        return "tops"
-    if v in {"bottoms", "bottom", "ボトムス", "パンツ", "ズボン", "skirt", "スカート"}:
-        return "bottoms"
-    if v in {"outer", "アウター", "コート", "ジャケット", "coat", "jacket"}:
-        return "outer"
-    if v in {"shoes", "shoe", "シューズ", "靴", "sneakers", "sneaker"}:
-        return "shoes"
-
-    # heuristic contains
-    if "トップ" in v or "シャツ" in v or "tshirt" in v or "t-shirt" in v or "shirt" in v:
-        return "tops"
-    if "ボトム" in v or "パンツ" in v or "ズボン" in v or "skirt" in v:
-        return "bottoms"
-    if "アウター" in v or "コート" in v or "ジャケット" in v or "outer" in v:
-        return "outer"
-    if "靴" in v or "シュー" in v or "shoe" in v or "sneaker" in v:
-        return "shoes"
 
-    return v
+def _norm_color(value: Optional[str]) -> Optional[str]:
+    v = _norm_text(value)
+    if not v:
+        return None
+    return _TAG_LOOKUP["color"].get(v) or _guess_color(v)
 
 
-def _norm_color(value: Optional[str]) -> Optional[str]:
+def _norm_tag(field: str, value: Any) -> Optional[str]:
+    """Normalize any tag field to the canonical vocabulary (falls back to `_norm_text`)."""
+
+    if field == "category":
+        return _norm_category(value)
+    if field == "color":
+        return _norm_color(value)
     v = _norm_text(value)
     if not v:
         return None
+    return _TAG_LOOKUP.get(field, {}).get(v) or v
 
-    # normalize common variants
-    if "navy" in v or "紺" in v:
-        return "navy"
-    if "black" in v or "黒" in v:
-        return "black"
-    if "white" in v or "白" in v:
-        return "white"
-    if "gray" in v or "grey" in v or "グレー" in v or "灰" in v:
-        return "gray"
-    if "beige" in v or "ベージュ" in v:
-        return "beige"
-    if "brown" in v or "茶" in v:
-        return "brown"
-    if "blue" in v or "青" in v:
-        return "blue"
-    if "red" in v or "赤" in v:
-        return "red"
-    if "green" in v or "緑" in v:
-        return "green"
 
-    return v
+def _normalize_item_tags(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonical tags for a closet item, stored as `normTags` at write time."""
+
+    out: Dict[str, Any] = {"v": _TAG_VOCAB_VERSION}
+    for field in ("category", "color", "subCategory", "sleeveLength", "hemLength", "scene"):
+        v = _norm_tag(field, item.get(field))
+        if v:
+            out[field] = v
+    seasons = _coerce_season_list(item.get("season"))
+    if seasons:
+        out["season"] = sorted(set(seasons))
+    return out
+
+
+def _item_norm_tags(item: Dict[str, Any]) -> Dict[str, Any]:
+    stored = item.get("normTags")
+    if isinstance(stored, dict) and stored.get("v") == _TAG_VOCAB_VERSION:
+        return stored
+    # Items written before normTags existed (or with an older vocabulary).
+    return _normalize_item_tags(item)
 
 
 def _category_color_norm(category: Optional[str], color: Optional[str]) -> Optional[str]:
@@ -777,52 +2844,323 @@ def _category_color_norm(category: Optional[str], color: Optional[str]) -> Optio
     return f"{c}#{col}"
 
 
+def _build_closet_snapshot(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Index a user's closet for matching.
+
+    Lookup indexes (stored categoryColor, normalized (category, color), normalized
+    category) hold positions into `items`. Scoring tags are encoded once into
+    per-field integer columns (0 = missing) plus a season bitmask, so matching
+    compares ints instead of re-normalizing strings per candidate.
+    """
+
+    by_category_color: Dict[str, List[int]] = {}
+    by_norm: Dict[Tuple[Optional[str], Optional[str]], List[int]] = {}
+    by_norm_category: Dict[Optional[str], List[int]] = {}
+    vocab: Dict[str, int] = {}
+    columns: Dict[str, List[int]] = {field: [] for field in _MATCH_TAG_FIELDS}
+    season_mask: List[int] = []
+
+    for pos, it in enumerate(items):
+        cc = it.get("categoryColor")
+        if isinstance(cc, str) and cc:
+            by_category_color.setdefault(cc, []).append(pos)
+        # Normalized at write time (normTags); older items are normalized here once per snapshot.
+        tags = _item_norm_tags(it)
+        cat = tags.get("category")
+        col = tags.get("color")
+        by_norm.setdefault((cat, col), []).append(pos)
+        by_norm_category.setdefault(cat, []).append(pos)
+
+        for field in _MATCH_TAG_FIELDS:
+            v = tags.get(field)
+            columns[field].append(vocab.setdefault(v, len(vocab) + 1) if v else 0)
+        season_mask.append(_season_mask(tags.get("season")))
+
+    return {
+        "items": items,
+        "byCategoryColor": by_category_color,
+        "byNorm": by_norm,
+        "byNormCategory": by_norm_category,
+        "vocab": vocab,
+        "columns": columns,
+        "seasonMask": season_mask,
+        "loadedAt": time.monotonic(),
+    }
+
+
+def _load_closet_snapshot(user_id: str) -> Dict[str, Any]:
+    now = time.monotonic()
+    with _CLOSET_SNAPSHOT_LOCK:
+        snap = _CLOSET_SNAPSHOTS.get(user_id)
+        if snap is not None and now - snap["loadedAt"] < _CLOSET_SNAPSHOT_TTL_SECONDS:
+            _CLOSET_SNAPSHOTS.move_to_end(user_id)
+            return snap
+        generation = _CLOSET_GENERATIONS.get(user_id, _CLOSET_GENERATION_FLOOR)
+
+    table = _get_table()
+    # Consistent, so a load right after an invalidating write sees that write.
+    items = list(
+        _iter_query_items(table, KeyConditionExpression=Key("userId").eq(user_id), ConsistentRead=True)
+    )
+    with _trace_stage("snapshotBuild"):
+        snap = _build_closet_snapshot(items)
+    _trace_count("closetItems", len(items))
+
+    with _CLOSET_SNAPSHOT_LOCK:
+        if _CLOSET_GENERATIONS.get(user_id, _CLOSET_GENERATION_FLOOR) != generation:
+            # A write landed while loading; serve this snapshot once, do not keep it.
+            _trace_count("closetSnapshotStale")
+            return snap
+        _CLOSET_SNAPSHOTS[user_id] = snap
+        _CLOSET_SNAPSHOTS.move_to_end(user_id)
+        while len(_CLOSET_SNAPSHOTS) > _CLOSET_SNAPSHOT_MAX_USERS:
+            _CLOSET_SNAPSHOTS.popitem(last=False)
+    return snap
+
+
+def _invalidate_closet_snapshot(user_id: str) -> None:
+    global _CLOSET_GENERATION_FLOOR
+    with _CLOSET_SNAPSHOT_LOCK:
+        _CLOSET_SNAPSHOTS.pop(user_id, None)
+        _CLOSET_GENERATIONS[user_id] = next(_CLOSET_GENERATION_SEQ)
+        _CLOSET_GENERATIONS.move_to_end(user_id)
+        while len(_CLOSET_GENERATIONS) > _CLOSET_SNAPSHOT_MAX_USERS:
+            _, evicted = _CLOSET_GENERATIONS.popitem(last=False)
+            _CLOSET_GENERATION_FLOOR = max(_CLOSET_GENERATION_FLOOR, evicted)
+
+
+def _snapshot_candidates(snap: Dict[str, Any], category: Optional[str], color: Optional[str]) -> List[int]:
+    """Positions of candidate items, same lookup order as the former per-item queries.
+
+    1) stored categoryColor == "<category>#<color>"
+    2) stored categoryColor == normalized "<category>#<color>"
+    3) normalized category and color match
+    4) normalized category only
+    """
+
+    by_cc = snap["byCategoryColor"]
+    category_color = _category_color(category, color)
+    if category_color and by_cc.get(category_color):
+        return by_cc[category_color]
+
+    category_color_norm = _category_color_norm(category, color)
+    if category_color_norm and category_color_norm != category_color and by_cc.get(category_color_norm):
+        return by_cc[category_color_norm]
+
+    det_cat = _norm_category(category)
+    det_col = _norm_color(color)
+    if det_cat and det_col:
+        filtered = snap["byNorm"].get((det_cat, det_col)) or []
+    elif det_cat:
+        filtered = snap["byNormCategory"].get(det_cat) or []
+    elif det_col:
+        filtered = sorted(pos for (_, col), ps in snap["byNorm"].items() if col == det_col for pos in ps)
+    else:
+        filtered = list(range(len(snap["items"])))
+
+    # If still empty and we had a color, relax to category-only.
+    if not filtered and det_cat:
+        filtered = snap["byNormCategory"].get(det_cat) or []
+    return filtered
+
+
+def _bump_collection_version(user_id: str, collection: str) -> bool:
+    """Invalidate list ETags after a batched write to "clothes" or "logs".
+
+    Single-item writes bump inside their transaction (_write_with_version_bump).
+    Returns False when the bump fails; the items are written by then, so the
+    caller reports it next to the per-item results instead of failing.
+    """
+
+    try:
+        _get_wearlog_table().update_item(
+            Key={"userId": user_id, "logId": _COLLECTION_VERSION_LOG_ID},
+            UpdateExpression="ADD #v :one",
+            ExpressionAttributeNames={"#v": _COLLECTION_VERSION_ATTRS[collection]},
+            ExpressionAttributeValues={":one": 1},
+        )
+    except (ClientError, BotoCoreError) as e:
+        print("Collection version bump failed:", str(e))
+        return False
+    return True
+
+
+_DYNAMODB_SERIALIZER = TypeSerializer()
+
+
+def _write_with_version_bump(table, user_id: str, collection: str, action: str, **params) -> None:
+    """One Put, Update or Delete on `table` plus the list version bump, all or nothing.
+
+    `params` are the table call's arguments (Item or Key, expressions). A failed
+    condition on the write raises ConditionalCheckFailedException, as the
+    single-item call would.
+    """
+
+    write: Dict[str, Any] = {"TableName": table.name}
+    for name, value in params.items():
+        if name in ("Item", "Key", "ExpressionAttributeValues"):
+            value = {k: _DYNAMODB_SERIALIZER.serialize(v) for k, v in value.items()}
+        write[name] = value
+    bump = {
+        "TableName": _get_wearlog_table().name,
+        "Key": {"userId": {"S": user_id}, "logId": {"S": _COLLECTION_VERSION_LOG_ID}},
+        "UpdateExpression": "ADD #v :one",
+        "ExpressionAttributeNames": {"#v": _COLLECTION_VERSION_ATTRS[collection]},
+        "ExpressionAttributeValues": {":one": {"N": "1"}},
+    }
+    try:
+        with _trace_stage("ddbTransact"):
+            _get_aws_client("dynamodb").transact_write_items(TransactItems=[{action: write}, {"Update": bump}])
+    except ClientError as e:
+        reasons = e.response.get("CancellationReasons") or []
+        if reasons and reasons[0].get("Code") == "ConditionalCheckFailed":
+            raise ClientError(
+                {"Error": {"Code": "ConditionalCheckFailedException", "Message": str(e)}}, "TransactWriteItems"
+            ) from e
+        raise
+
+
+def _collection_etag(user_id: str, params: Dict[str, Any], *collections: str) -> Optional[str]:
+    """Weak ETag for one list response, or None if the version lookup fails.
+
+    Costs a single consistent GetItem. The user, the query parameters (filters,
+    fields, page token) and every collection the body is built from are part of
+    the tag.
+    """
+
+    names = {f"#v{i}": _COLLECTION_VERSION_ATTRS[c] for i, c in enumerate(collections)}
+    try:
+        with _trace_stage("ddbVersion"):
+            resp = _get_wearlog_table().get_item(
+                Key={"userId": user_id, "logId": _COLLECTION_VERSION_LOG_ID},
+                ProjectionExpression=", ".join(names),
+                ExpressionAttributeNames=names,
+                ConsistentRead=True,
+            )
+    except (ClientError, BotoCoreError) as e:
+        print("Collection version lookup failed:", str(e))
+        return None
+
+    item = resp.get("Item") or {}
+    versions = [[c, int(item.get(_COLLECTION_VERSION_ATTRS[c]) or 0)] for c in collections]
+    raw = json.dumps(
+        [user_id, versions, sorted((k, str(v)) for k, v in params.items() if v is not None)],
+        ensure_ascii=False,
+    )
+    return 'W/"' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _etag_matches(event, etag: str) -> bool:
+    header = _get_header(event, "If-None-Match")
+    if not header:
+        return False
+    # Weak comparison: the W/ prefix is ignored on both sides.
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == bare:
+            return True
+    return False
+
+
+def _projection_kwargs(q: Dict[str, Any]) -> Dict[str, Any]:
+    """ProjectionExpression kwargs for `fields=a,b,c` or `view=grid` (empty = full item)."""
+
+    view = (q.get("view") or "").strip()
+    fields_param = (q.get("fields") or "").strip()
+    if view:
+        if view not in _CLOTHES_VIEWS:
+            raise ValueError(f"Unknown view: {view}")
+        fields = list(_CLOTHES_VIEWS[view])
+    elif fields_param:
+        fields = [f.strip() for f in fields_param.split(",") if f.strip()]
+        unknown = [f for f in fields if f not in _CLOTHES_PROJECTABLE_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    else:
+        return {}
+
+    # The item key is always returned so clients can address the item.
+    fields = list(dict.fromkeys(["clothesId", *fields]))
+    names = {f"#p{i}": f for i, f in enumerate(fields)}
+    return {
+        "ProjectionExpression": ", ".join(names),
+        "ExpressionAttributeNames": names,
+    }
+
+
+def _public_clothes_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in item.items() if k not in _CLOTHES_INTERNAL_FIELDS}
+
+
 def _handle_get_list(event, user_id: str):
     table = _get_table()
     q = event.get("queryStringParameters") or {}
+    projection = _projection_kwargs(q)
     category = q.get("category")
     color = q.get("color")
     category_color = q.get("categoryColor") or _category_color(category, color)
+    limit = _parse_limit(q.get("limit"))
+    start_key = _decode_next_token(q.get("nextToken"), user_id)
+
+    # GSIs cannot be read consistently, so filtered lists are never tagged;
+    # base-table reads are consistent whenever a tag is returned.
+    etag = None if category_color else _collection_etag(user_id, q, "clothes")
+    if etag and _etag_matches(event, etag):
+        return _response(304, None, {"ETag": etag})
 
     try:
         if category_color:
             gsi_name = os.environ.get("CLOTHES_GSI_NAME", "byCategoryAndColor")
-            resp = table.query(
+            items, last_key = _query_page(
+                table,
+                limit=limit,
+                exclusive_start_key=start_key,
                 IndexName=gsi_name,
                 KeyConditionExpression=Key("userId").eq(user_id) & Key("categoryColor").eq(category_color),
+                **projection,
             )
         else:
-            resp = table.query(
+            items, last_key = _query_page(
+                table,
+                limit=limit,
+                exclusive_start_key=start_key,
                 KeyConditionExpression=Key("userId").eq(user_id),
+                ConsistentRead=etag is not None,
+                **projection,
             )
     except ClientError as e:
         return _response(500, {"ok": False, "error": str(e)})
 
-    items = resp.get("Items") or []
-    return _response(200, {"ok": True, "items": items})
+    items = [_public_clothes_item(it) for it in items]
+    return _response(
+        200,
+        {"ok": True, "items": items, "nextToken": _encode_next_token(last_key)},
+        {"ETag": etag} if etag else None,
+    )
 
 
-def _handle_get_one(user_id: str, clothes_id: str):
+def _handle_get_one(event, user_id: str, clothes_id: str):
     table = _get_table()
+    projection = _projection_kwargs(event.get("queryStringParameters") or {})
     try:
-        resp = table.get_item(Key={"userId": user_id, "clothesId": clothes_id})
+        resp = table.get_item(Key={"userId": user_id, "clothesId": clothes_id}, **projection)
     except ClientError as e:
         return _response(500, {"ok": False, "error": str(e)})
 
     item = resp.get("Item")
     if not item:
         return _response(404, {"ok": False, "error": "Not found"})
-    return _response(200, {"ok": True, "item": item})
+    return _response(200, {"ok": True, "item": _public_clothes_item(item)})
 
 
-def _handle_post(event, user_id: str):
-    table = _get_table()
-    payload = _parse_json_body(event)
+def _new_clothes_item(user_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Validated Clothes item for a create payload (raises ValueError)."""
 
     category = payload.get("category")
     color = payload.get("color")
     if not category or not color:
-        return _response(400, {"ok": False, "error": "category and color are required"})
+        raise ValueError("category and color are required")
 
     clothes_id = str(uuid.uuid4())
 
@@ -859,13 +3197,24 @@ def _handle_post(event, user_id: str):
         "updatedAt": updated_at,
     }
     item = {k: v for k, v in item.items() if v is not None}
+    item["normTags"] = _normalize_item_tags(item)
+    return item
+
+
+def _handle_post(event, user_id: str):
+    table = _get_table()
+    payload = _parse_json_body(event)
+    item = _new_clothes_item(user_id, payload)
 
     try:
-        table.put_item(Item=item, ConditionExpression="attribute_not_exists(clothesId)")
+        _write_with_version_bump(
+            table, user_id, "clothes", "Put", Item=item, ConditionExpression="attribute_not_exists(clothesId)"
+        )
     except ClientError as e:
         return _response(500, {"ok": False, "error": str(e)})
+    _invalidate_closet_snapshot(user_id)
 
-    return _response(201, {"ok": True, "item": item})
+    return _response(201, {"ok": True, "item": _public_clothes_item(item)})
 
 
 def _handle_put(event, user_id: str, clothes_id: str):
@@ -904,18 +3253,19 @@ def _handle_put(event, user_id: str, clothes_id: str):
         else:
             return _response(400, {"ok": False, "error": "season must be a list of strings"})
 
-    # If category/color changes, keep categoryColor consistent
-    category = updates.get("category")
-    color = updates.get("color")
-    if category is not None or color is not None:
-        # Need current values if only one of them is provided
+    # If tags change, keep categoryColor and normTags consistent with the merged item
+    tag_fields = ("category", "subCategory", "color", "sleeveLength", "hemLength", "season", "scene")
+    if any(updates.get(k) is not None for k in tag_fields):
+        # Need current values for the fields that are not being updated
         current_resp = table.get_item(Key={"userId": user_id, "clothesId": clothes_id})
         current = current_resp.get("Item")
         if not current:
             return _response(404, {"ok": False, "error": "Not found"})
-        category_final = category if category is not None else current.get("category")
-        color_final = color if color is not None else current.get("color")
-        updates["categoryColor"] = _category_color(category_final, color_final)
+        merged = dict(current)
+        merged.update({k: v for k, v in updates.items() if v is not None})
+        if updates.get("category") is not None or updates.get("color") is not None:
+            updates["categoryColor"] = _category_color(merged.get("category"), merged.get("color"))
+        updates["normTags"] = _normalize_item_tags(merged)
 
     updates["updatedAt"] = _now_epoch_seconds()
 
@@ -936,27 +3286,43 @@ def _handle_put(event, user_id: str, clothes_id: str):
 
     update_expr = "SET " + ", ".join(expr_parts)
 
+    key = {"userId": user_id, "clothesId": clothes_id}
     try:
-        resp = table.update_item(
-            Key={"userId": user_id, "clothesId": clothes_id},
+        _write_with_version_bump(
+            table,
+            user_id,
+            "clothes",
+            "Update",
+            Key=key,
             UpdateExpression=update_expr,
             ExpressionAttributeNames=expr_names,
             ExpressionAttributeValues=expr_values,
             ConditionExpression="attribute_exists(userId) AND attribute_exists(clothesId)",
-            ReturnValues="ALL_NEW",
         )
     except ClientError as e:
         if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
             return _response(404, {"ok": False, "error": "Not found"})
         return _response(500, {"ok": False, "error": str(e)})
+    _invalidate_closet_snapshot(user_id)
 
-    return _response(200, {"ok": True, "item": resp.get("Attributes")})
+    # Transactions return no attributes; read the item back. The update is
+    # committed either way, so a failed read falls back to the changed fields.
+    try:
+        item = table.get_item(Key=key, ConsistentRead=True).get("Item")
+    except ClientError as e:
+        print("Read after update failed:", str(e))
+        item = None
+    return _response(200, {"ok": True, "item": _public_clothes_item(item or {**key, **updates})})
 
 
 def _handle_delete(user_id: str, clothes_id: str):
     table = _get_table()
     try:
-        table.delete_item(
+        _write_with_version_bump(
+            table,
+            user_id,
+            "clothes",
+            "Delete",
             Key={"userId": user_id, "clothesId": clothes_id},
             ConditionExpression="attribute_exists(userId) AND attribute_exists(clothesId)",
         )
@@ -964,11 +3330,246 @@ def _handle_delete(user_id: str, clothes_id: str):
         if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
             return _response(404, {"ok": False, "error": "Not found"})
         return _response(500, {"ok": False, "error": str(e)})
+    _invalidate_closet_snapshot(user_id)
 
     return _response(200, {"ok": True})
 
 
+def _batch_backoff_seconds(attempt: int) -> float:
+    # Full jitter keeps concurrent importers from retrying in lockstep.
+    cap = min(_DYNAMODB_BATCH_BACKOFF_MAX_SECONDS, _DYNAMODB_BATCH_BACKOFF_BASE_SECONDS * (2**attempt))
+    return random.uniform(0, cap)
+
+
+def _batch_write(table_name: str, requests: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], str]]:
+    """BatchWriteItem in chunks of 25, retrying UnprocessedItems with backoff.
+
+    Returns (request, error) for every request that was not written.
+    """
+
+    dynamodb = _get_aws_resource("dynamodb")
+    failed: List[Tuple[Dict[str, Any], str]] = []
+    for start in range(0, len(requests), _DYNAMODB_BATCH_WRITE_SIZE):
+        pending = requests[start : start + _DYNAMODB_BATCH_WRITE_SIZE]
+        for attempt in range(_DYNAMODB_BATCH_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(_time_left("dynamodb batch write", _batch_backoff_seconds(attempt)))
+            else:
+                _time_left("dynamodb batch write")
+            try:
+                with _trace_stage("ddbBatchWrite"):
+                    resp = dynamodb.batch_write_item(RequestItems={table_name: pending})
+                _trace_count("ddbBatchCalls")
+            except ClientError as e:
+                failed.extend((req, str(e)) for req in pending)
+                pending = []
+                break
+            pending = (resp.get("UnprocessedItems") or {}).get(table_name) or []
+            if not pending:
+                break
+        failed.extend((req, "Unprocessed after retries") for req in pending)
+    return failed
+
+
+def _batch_get(
+    table_name: str, keys: List[Dict[str, Any]], *, consistent_read: bool = False
+) -> List[Dict[str, Any]]:
+    """BatchGetItem in chunks of 100, retrying UnprocessedKeys with backoff.
+
+    Keys still unprocessed after the last attempt are logged and left out.
+    """
+
+    dynamodb = _get_aws_resource("dynamodb")
+    found: List[Dict[str, Any]] = []
+    for start in range(0, len(keys), _DYNAMODB_BATCH_GET_SIZE):
+        request: Dict[str, Any] = {"Keys": keys[start : start + _DYNAMODB_BATCH_GET_SIZE]}
+        if consistent_read:
+            request["ConsistentRead"] = True
+        for attempt in range(_DYNAMODB_BATCH_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(_time_left("dynamodb batch get", _batch_backoff_seconds(attempt)))
+            else:
+                _time_left("dynamodb batch get")
+            with _trace_stage("ddbBatchGet"):
+                resp = dynamodb.batch_get_item(RequestItems={table_name: request})
+            _trace_count("ddbBatchCalls")
+            found.extend((resp.get("Responses") or {}).get(table_name) or [])
+            request = (resp.get("UnprocessedKeys") or {}).get(table_name) or {}
+            if not request.get("Keys"):
+                break
+        if request.get("Keys"):
+            print("BatchGetItem left keys unprocessed:", len(request["Keys"]))
+    return found
+
+
+def _handle_post_batch(event, user_id: str):
+    """POST /clothes/batch: create many garments with batched writes.
+
+    Body: {"items": [<same fields as POST /clothes>, ...]}. Each entry is
+    validated on its own and reported as {"index", "ok", "item" | "error"}.
+    "listCacheInvalidated": false means the writes landed but list ETags were
+    not bumped; clients should drop cached lists.
+    """
+
+    payload = _parse_json_body(event)
+    entries = payload.get("items")
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("items must be a non-empty array")
+    if len(entries) > _CLOTHES_BATCH_MAX:
+        raise ValueError(f"At most {_CLOTHES_BATCH_MAX} items per batch")
+
+    results: List[Dict[str, Any]] = []
+    requests: List[Dict[str, Any]] = []
+    result_by_id: Dict[str, Dict[str, Any]] = {}
+    for i, entry in enumerate(entries):
+        result: Dict[str, Any] = {"index": i}
+        results.append(result)
+        try:
+            if not isinstance(entry, dict):
+                raise ValueError("each item must be an object")
+            item = _new_clothes_item(user_id, entry)
+        except ValueError as e:
+            result.update({"ok": False, "error": str(e)})
+            continue
+        result.update({"ok": True, "item": _public_clothes_item(item)})
+        result_by_id[item["clothesId"]] = result
+        requests.append({"PutRequest": {"Item": item}})
+
+    failures = _batch_write(_get_table().name, requests)
+    for req, error in failures:
+        result = result_by_id[req["PutRequest"]["Item"]["clothesId"]]
+        result.pop("item", None)
+        result.update({"ok": False, "error": error})
+
+    body: Dict[str, Any] = {"ok": True, "results": results}
+    if len(requests) > len(failures):
+        _invalidate_closet_snapshot(user_id)
+        if not _bump_collection_version(user_id, "clothes"):
+            body["listCacheInvalidated"] = False
+
+    body["failedCount"] = sum(1 for r in results if not r.get("ok"))
+    return _response(200, body)
+
+
+def _handle_delete_batch(event, user_id: str):
+    """DELETE /clothes/batch: body {"clothesIds": [...]}.
+
+    Batched deletes are unconditional, so ids that do not exist are reported
+    as deleted (unlike DELETE /clothes/{id}, which returns 404).
+    "listCacheInvalidated" is reported as in POST /clothes/batch.
+    """
+
+    payload = _parse_json_body(event)
+    raw_ids = payload.get("clothesIds")
+    if not isinstance(raw_ids, list) or not raw_ids:
+        raise ValueError("clothesIds must be a non-empty array")
+    if len(raw_ids) > _CLOTHES_BATCH_MAX:
+        raise ValueError(f"At most {_CLOTHES_BATCH_MAX} clothesIds per batch")
+    # A batch may not touch the same key twice.
+    clothes_ids = list(dict.fromkeys(str(c).strip() for c in raw_ids if str(c).strip()))
+    if not clothes_ids:
+        raise ValueError("clothesIds must be a non-empty array")
+
+    requests = [{"DeleteRequest": {"Key": {"userId": user_id, "clothesId": c}}} for c in clothes_ids]
+    failures = _batch_write(_get_table().name, requests)
+    errors = {req["DeleteRequest"]["Key"]["clothesId"]: error for req, error in failures}
+
+    results = [
+        {"clothesId": c, "ok": False, "error": errors[c]} if c in errors else {"clothesId": c, "ok": True}
+        for c in clothes_ids
+    ]
+    body: Dict[str, Any] = {"ok": True, "results": results, "failedCount": len(errors)}
+    if len(clothes_ids) > len(errors):
+        _invalidate_closet_snapshot(user_id)
+        if not _bump_collection_version(user_id, "clothes"):
+            body["listCacheInvalidated"] = False
+    return _response(200, body)
+
+
+def _is_sqs_event(event) -> bool:
+    records = event.get("Records")
+    return isinstance(records, list) and bool(records) and (records[0] or {}).get("eventSource") == "aws:sqs"
+
+
+def _accepts_gzip(event) -> bool:
+    value = _get_header(event, "Accept-Encoding")
+    if not value:
+        return False
+    for token in value.split(","):
+        coding, _, params = token.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            q = params.strip().replace(" ", "")
+            return q not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def _compress_response(event, resp: Dict[str, Any]) -> Dict[str, Any]:
+    """Gzip large bodies for clients that accept it.
+
+    Disabled unless RESPONSE_GZIP_MIN_BYTES > 0: API Gateway must have binary
+    media types enabled (e.g. "*/*") to turn the base64 body back into bytes.
+    """
+
+    body = resp.get("body")
+    if (
+        _GZIP_MIN_BYTES <= 0
+        or resp.get("isBase64Encoded")
+        or not isinstance(body, str)
+        or len(body) < _GZIP_MIN_BYTES
+        or not _accepts_gzip(event)
+    ):
+        return resp
+
+    with _trace_stage("gzip"):
+        compressed = gzip.compress(body.encode("utf-8"), compresslevel=_GZIP_LEVEL)
+    _trace_bytes("gzipBytes", len(compressed))
+    headers = dict(resp.get("headers") or {})
+    headers["Content-Encoding"] = "gzip"
+    headers["Vary"] = "Accept-Encoding"
+    out = dict(resp)
+    out.update(
+        headers=headers,
+        body=base64.b64encode(compressed).decode("ascii"),
+        isBase64Encoded=True,
+    )
+    return out
+
+
+def _route_label(method: str, path: str) -> str:
+    # Collapse ids so metrics group by route, e.g. "GET /clothes/{id}".
+    parts = path.strip("/").split("/")
+    if len(parts) == 2 and parts[1] not in ("batch", "stats"):
+        parts[1] = "{id}"
+    return f"{method} /{'/'.join(parts)}"
+
+
 def handler(event, context):
+    sqs = _is_sqs_event(event)
+    trace = _trace_begin("SQS analyze" if sqs else "unrouted", context)
+    token = _TRACE.set(trace)
+    deadline_token = _DEADLINE.set(
+        _deadline_from_context(context, limit_ms=None if sqs else _API_GATEWAY_TIMEOUT_MS)
+    )
+    gemini_timeout_token = _GEMINI_TIMEOUT.set(_GEMINI_WORKER_TIMEOUT_SECONDS if sqs else _GEMINI_TIMEOUT_SECONDS)
+    resp: Optional[Dict[str, Any]] = None
+    try:
+        if sqs:
+            resp = _handle_analyze_queue(event)
+        else:
+            resp = _compress_response(event, _dispatch(event, context))
+        return resp
+    finally:
+        _GEMINI_TIMEOUT.reset(gemini_timeout_token)
+        _DEADLINE.reset(deadline_token)
+        _TRACE.reset(token)
+        if trace is not None:
+            try:
+                _trace_emit(trace, (resp or {}).get("statusCode"))
+            except Exception as e:
+                print("Trace emit failed:", str(e))
+
+
+def _dispatch(event, context):
     try:
         if (event.get("httpMethod") or "").upper() == "OPTIONS":
             return _response(200, {"ok": True})
@@ -979,12 +3580,28 @@ def handler(event, context):
 
         method = (event.get("httpMethod") or "").upper()
         path = _get_api_path(event)
+        _trace_set_route(_route_label(method, path))
+
+        if path.endswith("/analyze/batch"):
+            if method != "POST":
+                return _response(405, {"ok": False, "error": "Method not allowed"})
+            return _handle_analyze_batch(event, user_id)
+
+        if "/analyze/" in path:
+            if method != "GET":
+                return _response(405, {"ok": False, "error": "Method not allowed"})
+            return _handle_analyze_job_get(user_id, path.rsplit("/", 1)[-1])
 
         if path.endswith("/analyze"):
             if method != "POST":
                 return _response(405, {"ok": False, "error": "Method not allowed"})
             return _handle_analyze(event, user_id)
 
+        if path.endswith("/logs/stats"):
+            if method != "GET":
+                return _response(405, {"ok": False, "error": "Method not allowed"})
+            return _handle_logs_stats(event, user_id)
+
         if path.endswith("/logs"):
             if method == "GET":
                 return _handle_logs_get(event, user_id)
@@ -992,6 +3609,13 @@ def handler(event, context):
                 return _handle_logs_post(event, user_id)
             return _response(405, {"ok": False, "error": "Method not allowed"})
 
+        if path.endswith("/clothes/batch"):
+            if method == "POST":
+                return _handle_post_batch(event, user_id)
+            if method == "DELETE":
+                return _handle_delete_batch(event, user_id)
+            return _response(405, {"ok": False, "error": "Method not allowed"})
+
         clothes_id = _get_clothes_id_from_event(event)
 
         if method == "GET" and clothes_id is None:
@@ -999,13 +3623,19 @@ def handler(event, context):
         if method == "POST" and clothes_id is None:
             return _handle_post(event, user_id)
         if method == "GET" and clothes_id is not None:
-            return _handle_get_one(user_id, clothes_id)
+            return _handle_get_one(event, user_id, clothes_id)
         if method in ("PUT", "PATCH") and clothes_id is not None:
             return _handle_put(event, user_id, clothes_id)
         if method == "DELETE" and clothes_id is not None:
             return _handle_delete(user_id, clothes_id)
 
         return _response(404, {"ok": False, "error": "Not found"})
+    except _DeadlineExceeded as e:
+        return _response(504, {"ok": False, "error": str(e)})
+    except _GeminiUnavailable as e:
+        return _response(
+            503, {"ok": False, "error": str(e)}, headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
     except ValueError as e:
         return _response(400, {"ok": False, "error": str(e)})
     except Exception as e:
@@ -1019,3 +3649,12 @@ def handler(event, context):
             return _response(500, {"ok": False, "error": f"{type(e).__name__}: {str(e)}"})
 
         return _response(500, {"ok": False, "error": "Internal server error"})
+
+
+# Last, so that everything warm-up touches is defined.
+if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") and (os.environ.get("WARM_UP_ON_INIT") or "1") != "0":
+    try:
+        _warm_up()
+    except Exception as e:
+        # Never fail init because of warm-up; the lazy path will retry per request.
+        print("Warm-up failed:", str(e))
@@ -40,11 +40,12 @@ class _CalendarPageState extends State<CalendarPage> {
     });
 
     try {
-      final logs = await SelfieApiService().listWearLogs();
+      final logs = await SelfieApiService().listWearLogs(expandClothes: true);
 
       if (!mounted) return;
       setState(() {
         _wearLogs = logs;
+        _seedClothesFromLogs(logs);
         _rebuildWearLogsByDay();
       });
     } catch (_) {
@@ -168,6 +169,19 @@ class _CalendarPageState extends State<CalendarPage> {
     );
   }
 
+  // Garments inlined by `expand=clothes`; anything missing still loads per id.
+  void _seedClothesFromLogs(List<Map<String, dynamic>> logs) {
+    for (final log in logs) {
+      final clothes = log['clothes'];
+      if (clothes is! List) continue;
+      for (final item in clothes.whereType<Map>()) {
+        final id = item['clothesId']?.toString().trim();
+        if (id == null || id.isEmpty) continue;
+        _clothesByIdFutures[id] = Future.value(Map<String, dynamic>.from(item));
+      }
+    }
+  }
+
   Future<Map<String, dynamic>> _getClothesById(String id) {
     final trimmed = id.trim();
     return _clothesByIdFutures.putIfAbsent(trimmed, () {
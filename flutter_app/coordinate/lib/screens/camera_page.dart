@@ -377,9 +377,14 @@ class _CameraPageState extends State<CameraPage> {
         _selections = {};
       });
 
+      // degraded: the image was not analyzed; candidates are in-season,
+      // recently worn clothes per category.
+      final message = decoded['degraded'] == true
+          ? '画像解析が混み合っているため、季節と最近の着用履歴から候補を表示しています'
+          : '解析が完了しました。候補を選択してください';
       ScaffoldMessenger.of(
         context,
-      ).showSnackBar(const SnackBar(content: Text('解析が完了しました。候補を選択してください')));
+      ).showSnackBar(SnackBar(content: Text(message)));
     } on AuthException catch (e) {
       if (!mounted) return;
       ScaffoldMessenger.of(
@@ -2,6 +2,8 @@ import 'dart:convert';
 
 import 'package:amplify_flutter/amplify_flutter.dart';
 
+import 'paged_list.dart';
+
 class ClothesApiService {
   static const String _apiName = 'apif4831e80';
 
@@ -45,27 +47,19 @@ class ClothesApiService {
       }
     }
 
-    final operation = Amplify.API.get(
+    return fetchPagedList(
       '/clothes',
       apiName: _apiName,
-      queryParameters: queryParameters.isEmpty ? null : queryParameters,
+      queryParameters: queryParameters,
+      decodePage: (response) {
+        if (response.statusCode >= 400) {
+          _throwHttpError(response);
+        }
+        final decoded = _decodeJsonOrThrow(response.decodeBody());
+        _throwIfNotOk(decoded);
+        return decoded;
+      },
     );
-
-    final response = await operation.response;
-    if (response.statusCode >= 400) {
-      _throwHttpError(response);
-    }
-    final decoded = _decodeJsonOrThrow(response.decodeBody());
-    _throwIfNotOk(decoded);
-
-    final items = decoded['items'];
-    if (items is List) {
-      return items
-          .whereType<Map>()
-          .map((e) => Map<String, dynamic>.from(e))
-          .toList();
-    }
-    return const [];
   }
 
   Future<Map<String, dynamic>> getClothes(String clothesId) async {
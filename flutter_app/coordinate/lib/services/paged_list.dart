@@ -0,0 +1,65 @@
+import 'dart:convert';
+
+import 'package:amplify_flutter/amplify_flutter.dart';
+
+// Last complete list per path and query; revalidated with If-None-Match so an
+// unchanged list costs one 304 instead of a full refetch.
+final Map<String, ({String etag, List<Map<String, dynamic>> items})>
+    _listCache = {};
+
+/// GETs [path] and follows `nextToken` until the list is complete.
+///
+/// [decodePage] turns one response into its JSON object and throws on errors.
+/// Only the first page is conditional; a 304 returns the cached list.
+Future<List<Map<String, dynamic>>> fetchPagedList(
+  String path, {
+  required String apiName,
+  required Map<String, String> queryParameters,
+  required Map<String, dynamic> Function(AWSHttpResponse response) decodePage,
+}) async {
+  final cacheKey = '$path?${jsonEncode(queryParameters)}';
+  final cached = _listCache[cacheKey];
+  final results = <Map<String, dynamic>>[];
+  String? etag;
+  String? nextToken;
+  do {
+    final pageParameters = Map<String, String>.from(queryParameters);
+    if (nextToken != null) {
+      pageParameters['nextToken'] = nextToken;
+    }
+
+    final operation = Amplify.API.get(
+      path,
+      apiName: apiName,
+      headers: nextToken == null && cached != null
+          ? {'If-None-Match': cached.etag}
+          : null,
+      queryParameters: pageParameters.isEmpty ? null : pageParameters,
+    );
+
+    final response = await operation.response;
+    if (response.statusCode == 304 && cached != null) {
+      return cached.items.map((e) => Map<String, dynamic>.from(e)).toList();
+    }
+    if (nextToken == null) {
+      etag = response.headers['etag'];
+    }
+    final decoded = decodePage(response);
+
+    final items = decoded['items'];
+    if (items is List) {
+      results.addAll(
+        items.whereType<Map>().map((e) => Map<String, dynamic>.from(e)),
+      );
+    }
+    final token = decoded['nextToken'];
+    nextToken = token is String && token.isNotEmpty ? token : null;
+  } while (nextToken != null);
+
+  if (etag != null && etag.isNotEmpty) {
+    _listCache[cacheKey] = (etag: etag, items: results);
+  } else {
+    _listCache.remove(cacheKey);
+  }
+  return results.map((e) => Map<String, dynamic>.from(e)).toList();
+}
@@ -3,6 +3,7 @@ import 'dart:convert';
 import 'package:amplify_flutter/amplify_flutter.dart';
 
 import 'clothes_api_service.dart' as app;
+import 'paged_list.dart';
 
 class SelfieApiService {
   static const String _apiName = 'apif4831e80';
@@ -104,11 +105,15 @@ class SelfieApiService {
     return decoded;
   }
 
+  /// With [expandClothes], each log also carries its garments under `clothes`.
   Future<List<Map<String, dynamic>>> listWearLogs({
     String? from,
     String? to,
+    bool expandClothes = false,
   }) async {
-    final queryParameters = <String, String>{};
+    final queryParameters = <String, String>{
+      if (expandClothes) 'expand': 'clothes',
+    };
     if (from != null && from.trim().isNotEmpty) {
       queryParameters['from'] = from.trim();
     }
@@ -116,27 +121,18 @@ class SelfieApiService {
       queryParameters['to'] = to.trim();
     }
 
-    final operation = Amplify.API.get(
+    return fetchPagedList(
       '/logs',
       apiName: _apiName,
-      queryParameters: queryParameters.isEmpty ? null : queryParameters,
+      queryParameters: queryParameters,
+      decodePage: (response) {
+        if (response.statusCode >= 400) {
+          _throwHttpError(response);
+        }
+        final decoded = _decodeJsonOrThrow(response.decodeBody());
+        _throwIfNotOk(decoded);
+        return decoded;
+      },
     );
-
-    final response = await operation.response;
-    if (response.statusCode >= 400) {
-      _throwHttpError(response);
-    }
-
-    final decoded = _decodeJsonOrThrow(response.decodeBody());
-    _throwIfNotOk(decoded);
-
-    final items = decoded['items'];
-    if (items is List) {
-      return items
-          .whereType<Map>()
-          .map((e) => Map<String, dynamic>.from(e))
-          .toList();
-    }
-    return const [];
   }
 }